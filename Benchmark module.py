@@ -0,0 +1,283 @@
+import os
+import sys
+import io
+import json
+import time
+import random
+import argparse
+import platform
+import itertools
+import contextlib
+import multiprocessing
+import importlib.util
+from graphviz import Digraph
+
+
+def load_test_module():
+    """Загружает "Test module v4.py": дальше используются его load_script и загруженный им v3."""
+    module = sys.modules.get('test_module_v4')
+    if module is None:
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Test module v4.py')
+        spec = importlib.util.spec_from_file_location('test_module_v4', path)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules['test_module_v4'] = module
+        spec.loader.exec_module(module)
+    return module
+
+
+test_module = load_test_module()
+load_script = test_module.load_script
+rewrite = test_module.rewrite
+
+
+# Сравниваемые варианты: имя -> файл скрипта
+VARIANTS = {
+    'v1': 'Regular tree rewrite.py',
+    'v2': 'Regular tree rewrite v2.py',
+    'v3': 'Regular tree rewrite v3.py',
+}
+
+# Этапы конвейера каждого варианта и проверки из "Test module v4.py"
+PIPELINE_STAGES = ('tokenize', 'to_rpn', 'build_parse_tree_from_rpn', 'display_tree', 'add_nodes_edges',
+                   'create_graph', 'SMT2Converter.convert', 'verify_associativity')
+CHECK_STAGES = ('python_check', 'z3_check')
+STAGES = PIPELINE_STAGES + CHECK_STAGES
+
+
+def make_workload_regex(size, depth, width, seed=0):
+    """Детерминированное выражение длиной не меньше size символов из блоков
+    с вложенностью групп depth и числом ветвей объединения width."""
+    rng = random.Random(seed)
+    alphabet = 'abcd'
+    blocks = []
+    length = 0
+    while length < size:
+        text = rng.choice(alphabet)
+        for _ in range(depth):
+            branches = [text] + [rng.choice(alphabet) + rng.choice(alphabet) for _ in range(width - 1)]
+            text = '(' + '|'.join(branches) + ')' + ('*' if rng.random() < 0.5 else '')
+        blocks.append(text)
+        length += len(text)
+    return ''.join(blocks)
+
+
+def measure(func, repeat):
+    """(время, ошибка): вывод функции подавляется, исключение записывается вместо времени."""
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            return rewrite.best_time(func, repeat), None
+    except (RecursionError, MemoryError, ValueError, IndexError) as e:
+        return None, f"{type(e).__name__}: {e}"
+
+
+def pipeline_tasks(module, regex):
+    """Функции этапов конвейера варианта; входы каждого этапа готовятся заранее и в замер не входят."""
+    tokens = module.tokenize(regex)
+    rpn = module.to_rpn(tokens)
+    tree = module.build_parse_tree_from_rpn(rpn)
+    return {
+        'tokenize': lambda: module.tokenize(regex),
+        'to_rpn': lambda: module.to_rpn(tokens),
+        'build_parse_tree_from_rpn': lambda: module.build_parse_tree_from_rpn(rpn),
+        'display_tree': lambda: module.display_tree(tree),
+        'add_nodes_edges': lambda: module.add_nodes_edges(tree, Digraph()),
+        'create_graph': lambda: module.create_graph(tree),
+        'SMT2Converter.convert': lambda: module.SMT2Converter(tree).convert(),
+        'verify_associativity': lambda: module.verify_associativity(tree),
+    }
+
+
+def check_strings(regex, checks, seed):
+    """Строки для python_check и z3_check: поровну соответствующих и случайных.
+
+    Соответствующие строки строятся обходом дерева: для больших выражений
+    построение DFA ради равномерной выборки заняло бы больше самих проверок.
+    Генератор случайных чисел свой, общий модуль random не затрагивается."""
+    rng = random.Random(seed)
+    sampler = rewrite.StringSampler.from_regex(regex, rng=rng)
+    return [sampler.sample() if index % 2 == 0
+            else ''.join(rng.choice('abcd') for _ in range(rng.randint(0, 8)))
+            for index in range(checks)]
+
+
+def time_check_stage(stage, regex, strings, repeat):
+    """Замер проверки stage из "Test module v4.py" (выполняется в отдельном процессе)."""
+    check = getattr(test_module, stage)
+    return rewrite.best_time(lambda: [check(regex, text) for text in strings], repeat)
+
+
+class CheckRunner:
+    """Замеры проверок в отдельном процессе с ограничением времени.
+
+    re на выражениях с вложенными звёздочками откатывается экспоненциально
+    долго, а прервать его внутри процесса нельзя; при превышении timeout
+    процесс завершается и заменяется новым."""
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.pool = None
+
+    def measure(self, stage, regex, strings, repeat):
+        if self.pool is None:
+            self.pool = multiprocessing.Pool(1)
+        try:
+            return self.pool.apply_async(time_check_stage, (stage, regex, strings, repeat)).get(self.timeout), None
+        except multiprocessing.TimeoutError:
+            self.close()
+            return None, f"TimeoutError: дольше {self.timeout} с"
+        except (RecursionError, MemoryError, ValueError, IndexError) as e:
+            return None, f"{type(e).__name__}: {e}"
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+
+def run_benchmarks(sizes, depths, widths, variants=VARIANTS, stages=STAGES, repeat=3, checks=20, seed=0,
+                   check_timeout=60.0, stream=sys.stderr):
+    """Прогоняет этапы всех вариантов по сетке (размер, вложенность, ширина).
+
+    Возвращает список записей: вариант, этап, параметры, выражение (длина),
+    лучшее время или ошибка (например, RecursionError у рекурсивных версий
+    или превышение check_timeout у проверок)."""
+    modules = {name: load_script(f"benchmark_{name}", filename) for name, filename in variants.items()}
+    pipeline = [stage for stage in stages if stage in PIPELINE_STAGES]
+    check = [stage for stage in stages if stage in CHECK_STAGES]
+    runner = CheckRunner(check_timeout)
+    results = []
+
+    def record(params, variant, stage, seconds, error):
+        entry = dict(params, variant=variant, stage=stage, seconds=seconds, error=error)
+        if stage in CHECK_STAGES and seconds is not None:
+            entry['per_check'] = seconds / checks
+        results.append(entry)
+        timing = f"{seconds:.6f} с" if seconds is not None else error
+        print(f"{variant:<8}{stage:<28}size={params['size']:<8}depth={params['depth']:<4}"
+              f"width={params['width']:<4}{timing}", file=stream)
+
+    try:
+        for size, depth, width in itertools.product(sizes, depths, widths):
+            regex = make_workload_regex(size, depth, width, seed)
+            params = {'size': size, 'depth': depth, 'width': width, 'regex_length': len(regex)}
+            for name, module in modules.items():
+                try:
+                    tasks = pipeline_tasks(module, regex)
+                except (RecursionError, ValueError, IndexError) as e:
+                    for stage in pipeline:
+                        record(params, name, stage, None, f"{type(e).__name__}: {e}")
+                    continue
+                for stage in pipeline:
+                    record(params, name, stage, *measure(tasks[stage], repeat))
+            if check:
+                strings = check_strings(regex, checks, seed)
+                for stage in check:
+                    record(params, 'test-v4', stage, *runner.measure(stage, regex, strings, repeat))
+    finally:
+        runner.close()
+    return results
+
+
+def result_key(record):
+    return (record['variant'], record['stage'], record['size'], record['depth'], record['width'])
+
+
+def compare_results(baseline, current, tolerance=0.2, stream=sys.stderr):
+    """Сравнивает замеры с сохранёнными ранее; возвращает список регрессий:
+    этапы, ставшие медленнее более чем на tolerance, или начавшие падать."""
+    previous = {result_key(record): record for record in baseline}
+    regressions = []
+    for record in current:
+        old = previous.get(result_key(record))
+        if old is None:
+            continue
+        if old['seconds'] is not None and record['seconds'] is None:
+            regressions.append(dict(record, baseline_seconds=old['seconds']))
+        elif old['seconds'] and record['seconds'] and record['seconds'] > old['seconds'] * (1 + tolerance):
+            regressions.append(dict(record, baseline_seconds=old['seconds'],
+                                    ratio=record['seconds'] / old['seconds']))
+    for record in regressions:
+        change = f"x{record['ratio']:.2f}" if 'ratio' in record else record['error']
+        print(f"Регрессия: {record['variant']} {record['stage']} size={record['size']} depth={record['depth']} "
+              f"width={record['width']}: {change}", file=stream)
+    return regressions
+
+
+def parse_int_list(text):
+    return [int(item) for item in text.split(',') if item.strip()]
+
+
+def parse_variants(text):
+    """Список вариантов: известные имена (v1, v2, v3) или пары имя=путь к скрипту."""
+    variants = {}
+    for item in text.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        name, _, filename = item.partition('=')
+        if not filename:
+            if name not in VARIANTS:
+                raise argparse.ArgumentTypeError(f"Неизвестный вариант '{name}'.")
+            filename = VARIANTS[name]
+        variants[name] = filename
+    return variants
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Замеры этапов конвейера разных версий разбора регулярных выражений.")
+    parser.add_argument('--sizes', type=parse_int_list, default=[100, 1000, 10000], help="Длины выражений через запятую.")
+    parser.add_argument('--depths', type=parse_int_list, default=[1, 4, 16], help="Вложенность групп через запятую.")
+    parser.add_argument('--widths', type=parse_int_list, default=[2, 8], help="Число ветвей объединения через запятую.")
+    parser.add_argument('--variants', type=parse_variants, default=dict(VARIANTS),
+                        help="Варианты через запятую: v1, v2, v3 или имя=путь к скрипту.")
+    parser.add_argument('--stages', default=','.join(STAGES), help=f"Этапы через запятую ({', '.join(STAGES)}).")
+    parser.add_argument('--repeat', type=int, default=3, help="Число повторов замера (берётся лучшее время).")
+    parser.add_argument('--checks', type=int, default=20, help="Число строк для python_check и z3_check.")
+    parser.add_argument('--seed', type=int, default=0, help="Зерно генерации выражений и строк.")
+    parser.add_argument('--check-timeout', type=float, default=60.0,
+                        help="Ограничение времени замера одной проверки, в секундах.")
+    parser.add_argument('-o', '--output', help="Файл для результатов JSON (по умолчанию - стандартный вывод).")
+    parser.add_argument('--compare', help="Файл JSON с прошлыми результатами для поиска регрессий.")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Допустимое замедление при сравнении (доля).")
+    args = parser.parse_args(argv)
+    args.stages = [stage.strip() for stage in args.stages.split(',') if stage.strip()]
+    unknown = [stage for stage in args.stages if stage not in STAGES]
+    if unknown:
+        parser.error(f"Неизвестные этапы: {', '.join(unknown)}.")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    results = run_benchmarks(args.sizes, args.depths, args.widths, args.variants, args.stages,
+                             args.repeat, args.checks, args.seed, args.check_timeout)
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'repeat': args.repeat,
+            'checks': args.checks,
+            'seed': args.seed,
+            'check_timeout': args.check_timeout,
+            'variants': args.variants,
+        },
+        'results': results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            file.write(text + '\n')
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as file:
+            baseline = json.load(file)['results']
+        if compare_results(baseline, results, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,31 @@ from z3 import Solver, Bool, Or, And, sat
 from graphviz import Digraph
 import os
 import subprocess
+import sys
+import json
+import time
+import argparse
+import contextlib
+import io
+import gc
+import itertools
+import bisect
+import functools
+import multiprocessing
+import weakref
+import hashlib
+import sqlite3
+import threading
+import mmap
+import struct
+import random
+from array import array
+from collections import OrderedDict, deque
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 class TreeNode:
@@ -17,6 +42,534 @@ class TreeNode:
         return f"Node({self.label}, {self.left}, {self.right})"
 
 
+class InternedNode:
+    """Неизменяемый узел с хеш-консингом: одинаковые поддеревья - один объект.
+
+    Хеш структурный и вычисляется один раз, сравнение - по идентичности.
+    Узлы создаются только через NodeTable.make."""
+    __slots__ = ('label', 'left', 'right', '_hash', '__weakref__')
+
+    def __init__(self, label, left=None, right=None):
+        self.label = label
+        self.left = left
+        self.right = right
+        self._hash = hash((label, left, right))
+
+    def __hash__(self):
+        return self._hash
+
+    def __repr__(self):
+        if self.left is None and self.right is None:
+            return f"Leaf({self.label})"
+        return f"Node({self.label}, {self.left}, {self.right})"
+
+
+class NodeTable:
+    """Таблица интернирования узлов на слабых ссылках.
+
+    Запись удаляется, как только на узел не остаётся внешних ссылок."""
+
+    def __init__(self):
+        self._nodes = weakref.WeakValueDictionary()
+
+    def make(self, label, left=None, right=None):
+        key = (label, left, right)
+        node = self._nodes.get(key)
+        if node is None:
+            node = InternedNode(label, left, right)
+            self._nodes[key] = node
+        return node
+
+    def __len__(self):
+        return len(self._nodes)
+
+
+default_node_table = NodeTable()
+
+
+def intern_tree(node, table=None):
+    """Переводит дерево TreeNode в интернированное представление."""
+    if node is None:
+        return None
+    if table is None:
+        table = default_node_table
+    interned = {}
+    stack = [(node, False)]
+    while stack:
+        current, expanded = stack.pop()
+        if expanded:
+            interned[id(current)] = table.make(
+                current.label,
+                interned[id(current.left)] if current.left else None,
+                interned[id(current.right)] if current.right else None,
+            )
+        elif id(current) not in interned:
+            stack.append((current, True))
+            if current.right:
+                stack.append((current.right, False))
+            if current.left:
+                stack.append((current.left, False))
+    return interned[id(node)]
+
+
+class NaryNode:
+    """Узел с произвольным числом потомков: цепочки ассоциативных '.' и '|'
+    хранятся одним узлом со списком потомков."""
+    __slots__ = ('label', 'children')
+
+    def __init__(self, label, children=()):
+        self.label = label
+        self.children = tuple(children)
+
+    def __repr__(self):
+        if not self.children:
+            return f"Leaf({self.label})"
+        return f"Nary({self.label}, {', '.join(map(repr, self.children))})"
+
+
+def flatten_associative(node):
+    """Сворачивает двоичные цепочки '.' и '|' в n-арные узлы NaryNode.
+
+    Например, a|b|c|...|z вместо дерева глубины 25 даёт один узел '|' с 26 потомками.
+    Каждая максимальная цепочка одинаковых операторов собирается за один спуск,
+    поэтому время линейно по размеру дерева. Листы с одной меткой - один общий
+    объект NaryNode: узлы не изменяются, а на больших деревьях листов большинство."""
+    with gc_paused():
+        return _flatten_associative(node)
+
+
+def _flatten_associative(node):
+    results = []
+    leaves = {}
+    stack = [(node, None)]
+    while stack:
+        current = stack.pop()
+        if type(current) is NaryNode:
+            # Готовый лист - операнд цепочки
+            results.append(current)
+            continue
+        current, count = current
+        label = current.label
+        if count is not None:
+            # Потомки уже свёрнуты и лежат на вершине results
+            children = results[-count:]
+            del results[-count:]
+            results.append(NaryNode(label, children))
+        elif label in ('|', '.'):
+            # Операнды цепочки слева направо: спуск по узлам с той же меткой
+            operands = []
+            pending = [current]
+            while pending:
+                item = pending.pop()
+                if item.label == label and item.left is not None:
+                    pending += (item.right, item.left)
+                else:
+                    operands.append(item)
+            stack.append((current, len(operands)))
+            for operand in reversed(operands):
+                if operand.left is None:
+                    leaf = leaves.get(operand.label)
+                    if leaf is None:
+                        leaf = leaves[operand.label] = NaryNode(operand.label)
+                    stack.append(leaf)
+                else:
+                    stack.append((operand, None))
+        elif label == '*':
+            stack += ((current, 1), (current.left, None))
+        else:
+            leaf = leaves.get(label)
+            if leaf is None:
+                leaf = leaves[label] = NaryNode(label)
+            results.append(leaf)
+    return results.pop()
+
+
+EPSILON = 'ε'
+
+
+def is_epsilon(node):
+    return node.label == EPSILON and not node.children
+
+
+def rule_flatten(engine, node):
+    """Вложенные цепочки: a·(b·c) → a·b·c, a|(b|c) → a|b|c."""
+    if node.label in ('.', '|') and any(child.label == node.label and child.children
+                                        for child in node.children):
+        children = []
+        for child in node.children:
+            if child.label == node.label and child.children:
+                children.extend(child.children)
+            else:
+                children.append(child)
+        return engine.make(node.label, children)
+    return None
+
+
+def rule_star_star(engine, node):
+    """(r*)* → r*."""
+    if node.label == '*' and node.children[0].label == '*':
+        return node.children[0]
+    return None
+
+
+def rule_star_epsilon(engine, node):
+    """ε* → ε."""
+    if node.label == '*' and is_epsilon(node.children[0]):
+        return node.children[0]
+    return None
+
+
+def rule_star_union(engine, node):
+    """(ε|r)* → r*, (r*|s)* → (r|s)*."""
+    if node.label != '*' or node.children[0].label != '|':
+        return None
+    branches = node.children[0].children
+    stripped = [branch.children[0] if branch.label == '*' else branch
+                for branch in branches if not is_epsilon(branch)]
+    if len(stripped) == len(branches) and all(a is b for a, b in zip(stripped, branches)):
+        return None
+    if not stripped:
+        return engine.make(EPSILON)
+    return engine.make('*', (engine.union(stripped),))
+
+
+def rule_concat_epsilon(engine, node):
+    """ε·r → r, r·ε → r."""
+    if node.label == '.' and any(is_epsilon(child) for child in node.children):
+        return engine.concat([child for child in node.children if not is_epsilon(child)])
+    return None
+
+
+def rule_single_child(engine, node):
+    """Цепочка из одного элемента равна этому элементу."""
+    if node.label in ('.', '|') and len(node.children) == 1:
+        return node.children[0]
+    return None
+
+
+def rule_union_dedup_sort(engine, node):
+    """r|r → r; ветви объединения упорядочиваются, чтобы одинаковые выражения совпадали."""
+    if node.label != '|':
+        return None
+    ordered = sorted(dict.fromkeys(node.children), key=engine.sort_key)
+    if len(ordered) == len(node.children) and all(a is b for a, b in zip(ordered, node.children)):
+        return None
+    return engine.union(ordered)
+
+
+def rule_union_factor_prefix(engine, node):
+    """Вынесение общего префикса: a·x|a·y → a·(x|y), a|a·y → a·(ε|y)."""
+    if node.label != '|':
+        return None
+    groups = {}
+    for branch in node.children:
+        if branch.label == '.':
+            head, tail = branch.children[0], branch.children[1:]
+        else:
+            head, tail = branch, ()
+        groups.setdefault(head, []).append(tail)
+    if len(groups) == len(node.children):
+        return None
+    branches = []
+    changed = False
+    for head, tails in groups.items():
+        originals = [engine.concat((head,) + tail) for tail in tails]
+        if len(tails) > 1:
+            factored = engine.simplify(
+                engine.concat((head, engine.union([engine.concat(tail) for tail in tails]))))
+            # Вынесение оставляется, только если упрощённое дерево становится меньше
+            if engine.size(factored) < sum(engine.size(branch) for branch in originals):
+                branches.append(factored)
+                changed = True
+                continue
+        branches.extend(originals)
+    return engine.union(branches) if changed else None
+
+
+def literal_word(node):
+    """Текст ветви из одних листов (лист или конкатенация листов) либо None."""
+    if not node.children:
+        return '' if is_epsilon(node) else node.label
+    if node.label == '.' and not any(child.children for child in node.children):
+        return ''.join('' if is_epsilon(child) else child.label for child in node.children)
+    return None
+
+
+def build_trie_union(engine, words):
+    """Строит по словам префиксное дерево и выдаёт факторизованное выражение.
+
+    Например, foo|foobar|fob → fo(o(bar|ε)|b). Слова сортируются, и каждый узел
+    префиксного дерева - это отрезок отсортированного списка: границы групп
+    ищутся двоичным поиском, а неветвящиеся участки (общий префикс группы,
+    хвост единственного слова) выдаются сразу одной конкатенацией. Поэтому
+    работа пропорциональна числу ветвлений, а не числу символов. Узлы
+    интернируются, и одинаковые суффиксы разных ветвей становятся одним объектом.
+
+    Ветви каждого узла упорядочены engine.sort_key и начинаются с разных букв,
+    так что результат уже в нормальной форме и отмечается engine.mark_normal."""
+    words = sorted(set(words))
+    epsilon = engine.make(EPSILON)
+    leaves = {char: engine.make(char) for char in set(''.join(words))}
+    chain = leaves.__getitem__
+    languages = {}
+    # Кадр (lo, hi, depth, groups): язык хвостов слов words[lo:hi] после первых depth символов
+    stack = [(0, len(words), 0, None)]
+    while stack:
+        lo, hi, depth, groups = stack.pop()
+        if groups is None:
+            terminal = len(words[lo]) == depth
+            start = lo + 1 if terminal else lo
+            groups = []
+            subframes = []
+            i = start
+            while i < hi:
+                word = words[i]
+                char = word[depth]
+                j = hi if ord(char) == 0x10FFFF else bisect.bisect_left(
+                    words, word[:depth] + chr(ord(char) + 1), i, hi)
+                if j - i == 1:
+                    groups.append((tuple(map(chain, word[depth:])), None))
+                else:
+                    common = len(os.path.commonprefix((word, words[j - 1])))
+                    groups.append((tuple(map(chain, word[depth:common])), (i, j, common)))
+                    subframes.append((i, j, common, None))
+                i = j
+            # Кадр возвращается на стек под своими подзадачами и собирается после них
+            stack.append((lo, hi, depth, (terminal, groups)))
+            stack.extend(subframes)
+            continue
+        terminal, groups = groups
+        branches = []
+        for prefix, sub in groups:
+            if sub is not None:
+                rest = languages.pop(sub)
+                if rest.label == '.':
+                    prefix += rest.children
+                elif rest is not epsilon:
+                    prefix += (rest,)
+            branch = engine.concat(prefix)
+            engine.mark_normal(branch)
+            branches.append(branch)
+        if terminal:
+            branches.append(epsilon)
+        branches.sort(key=engine.sort_key)
+        language = languages[(lo, hi, depth)] = engine.union(branches) if branches else epsilon
+        engine.mark_normal(language)
+    return languages[(0, len(words), 0)]
+
+
+def rule_union_trie(engine, node):
+    """Ветви-слова объединения с общими первыми буквами собираются в префиксное дерево."""
+    if node.label != '|':
+        return None
+    words = []
+    others = []
+    for branch in node.children:
+        word = literal_word(branch)
+        if word is None:
+            others.append(branch)
+        else:
+            words.append(word)
+    firsts = [word[0] for word in words if word]
+    if len(set(firsts)) == len(firsts):
+        return None
+    return engine.union(others + [build_trie_union(engine, words)])
+
+
+# Таблица правил: (имя, функция). Правило получает интернированный узел с потомками
+# в нормальной форме и возвращает замену либо None
+REWRITE_RULES = [
+    ('flatten', rule_flatten),
+    ('single_child', rule_single_child),
+    ('star_star', rule_star_star),
+    ('star_epsilon', rule_star_epsilon),
+    ('star_union', rule_star_union),
+    ('concat_epsilon', rule_concat_epsilon),
+    ('union_dedup_sort', rule_union_dedup_sort),
+    ('union_trie', rule_union_trie),
+    ('union_factor_prefix', rule_union_factor_prefix),
+]
+
+# Версия набора правил: увеличивается при любом изменении REWRITE_RULES или самих
+# правил, меняющем результат упрощения (2 - добавлено union_trie, 3 - структурный
+# порядок ветвей объединения, см. RewriteEngine.sort_key). Входит в ключ
+# дискового кэша режима --simplify, чтобы старые записи не выдавались за новые
+REWRITE_RULES_VERSION = 3
+
+
+class RewriteEngine:
+    """Переписывание n-арного дерева по таблице правил до неподвижной точки.
+
+    Дерево обходится снизу вверх; узлы интернируются (одинаковые поддеревья -
+    один объект), а нормальная форма каждого узла запоминается, поэтому
+    повторяющиеся поддеревья переписываются один раз. Для каждого правила
+    копится число срабатываний; при profile=True ещё и затраченное время и число
+    узлов до и после упрощения (замеры заметно замедляют переписывание)."""
+
+    def __init__(self, rules=None, profile=False):
+        self.rules = list(REWRITE_RULES if rules is None else rules)
+        self.profile = profile
+        # Правила, строящие сразу нормальные поддеревья (union_trie), рассчитаны
+        # на таблицу REWRITE_RULES; с другой таблицей их результат переписывается
+        self._default_rules = rules is None
+        self._apply = [(name, self._timed_rule(name, rule) if profile else rule) for name, rule in self.rules]
+        self._nodes = {}
+        self._normal = {}
+        self._sort_keys = {}
+        self._sizes = {}
+        self.rule_time = {name: 0.0 for name, _ in self.rules}
+        self.rule_hits = {name: 0 for name, _ in self.rules}
+        self.nodes_before = 0
+        self.nodes_after = 0
+        self.elapsed = 0.0
+
+    def make(self, label, children=()):
+        """Интернированный узел NaryNode."""
+        key = (label, tuple(children))
+        node = self._nodes.get(key)
+        if node is None:
+            node = self._nodes[key] = NaryNode(label, key[1])
+        return node
+
+    def concat(self, children):
+        children = tuple(children)
+        if not children:
+            return self.make(EPSILON)
+        return children[0] if len(children) == 1 else self.make('.', children)
+
+    def union(self, children):
+        children = tuple(children)
+        return children[0] if len(children) == 1 else self.make('|', children)
+
+    def sort_key(self, node):
+        """Структурный ключ узла для упорядочивания ветвей объединения: (метка, ключи потомков).
+
+        Ключ ссылается на уже построенные ключи потомков, а не копирует их, поэтому
+        время и память линейны по размеру дерева. Одинаковые поддеревья интернированы
+        и имеют один и тот же ключ, так что сравнение проходит только до первого
+        различия."""
+        keys = self._sort_keys
+        stack = [node]
+        while stack:
+            current = stack[-1]
+            if current in keys:
+                stack.pop()
+                continue
+            pending = [child for child in current.children if child not in keys]
+            if pending:
+                stack.extend(pending)
+                continue
+            stack.pop()
+            keys[current] = (current.label, tuple(keys[child] for child in current.children))
+        return keys[node]
+
+    def size(self, node):
+        return count_nodes(node, self._sizes)
+
+    def mark_normal(self, node):
+        """Запоминает интернированный узел, построенный правилом сразу в нормальной форме."""
+        if self._default_rules:
+            self._normal[node] = node
+
+    def _timed_rule(self, name, rule):
+        clock = time.perf_counter
+
+        def timed(engine, node):
+            started = clock()
+            try:
+                return rule(engine, node)
+            finally:
+                self.rule_time[name] += clock() - started
+        return timed
+
+    def rewrite(self, tree):
+        """Упрощает дерево (двоичное или n-арное) и возвращает интернированное n-арное дерево."""
+        started = time.perf_counter()
+        if not isinstance(tree, NaryNode):
+            tree = flatten_associative(tree)
+        with gc_paused():
+            if self.profile:
+                self.nodes_before = count_nodes(tree)
+            result = self.simplify(tree)
+            if self.profile:
+                self.nodes_after = count_nodes(result)
+        self.elapsed = time.perf_counter() - started
+        return result
+
+    def simplify(self, root):
+        normal = self._normal
+        stack = [(root, False)]
+        while stack:
+            node, expanded = stack.pop()
+            if node in normal:
+                continue
+            if not expanded:
+                stack.append((node, True))
+                stack.extend((child, False) for child in node.children if child not in normal)
+                continue
+            interned = self.make(node.label, [normal[child] for child in node.children])
+            result = normal.get(interned)
+            if result is None:
+                result = self._apply_rules(interned)
+                normal[interned] = result
+            normal[node] = result
+        return normal[root]
+
+    def _apply_rules(self, node):
+        # Потомки node уже в нормальной форме; правила применяются, пока какое-то срабатывает
+        while True:
+            known = self._normal.get(node)
+            if known is not None:
+                return known
+            for name, rule in self._apply:
+                result = rule(self, node)
+                if result is not None and result is not node:
+                    self.rule_hits[name] += 1
+                    node = self.make(result.label, [self.simplify(child) for child in result.children])
+                    break
+            else:
+                self._normal[node] = node
+                return node
+
+    def add_stats(self, totals):
+        """Добавляет число узлов и время правил (замеры profile=True) к словарю накопленных показателей."""
+        totals['nodes_before'] = totals.get('nodes_before', 0) + self.nodes_before
+        totals['nodes_after'] = totals.get('nodes_after', 0) + self.nodes_after
+        for name, seconds in self.rule_time.items():
+            totals[f'rule {name}'] = totals.get(f'rule {name}', 0.0) + seconds
+            totals[f'hits {name}'] = totals.get(f'hits {name}', 0) + self.rule_hits[name]
+
+    def report(self, stream=sys.stderr):
+        if self.profile:
+            print(f"Узлов до упрощения: {self.nodes_before}, после: {self.nodes_after}, "
+                  f"время: {self.elapsed:.4f} с", file=stream)
+        else:
+            print(f"Время упрощения: {self.elapsed:.4f} с", file=stream)
+        for name, _ in self.rules:
+            timing = f"  время: {self.rule_time[name]:.4f} с" if self.profile else ''
+            print(f"  {name:<22} срабатываний: {self.rule_hits[name]:8}{timing}", file=stream)
+
+
+def count_nodes(node, sizes=None):
+    """Число узлов n-арного дерева; общие поддеревья считаются при каждом вхождении.
+
+    sizes - необязательный словарь уже посчитанных размеров, пополняется по ходу."""
+    sizes = {} if sizes is None else sizes
+    stack = [node]
+    while stack:
+        current = stack[-1]
+        if current in sizes:
+            stack.pop()
+            continue
+        pending = [child for child in current.children if child not in sizes]
+        if pending:
+            stack.extend(pending)
+            continue
+        stack.pop()
+        sizes[current] = 1 + sum(sizes[child] for child in current.children)
+    return sizes[node]
+
+
 def is_valid_regex(expression):
     """Проверяет корректность регулярного выражения."""
     try:
@@ -76,6 +629,8 @@ def to_rpn(tokens):
         elif token == ')':
             while stack and stack[-1] != '(':
                 output.append(stack.pop())
+            if not stack:
+                raise ValueError("Лишняя закрывающая скобка ')'.")
             stack.pop()  # Удаляем '('
         else:  # Операторы
             while stack and stack[-1] != '(' and precedence.get(stack[-1], 0) >= precedence.get(token, 0):
@@ -88,30 +643,33 @@ def to_rpn(tokens):
     return output
 
 
-def build_parse_tree_from_rpn(rpn):
+def build_parse_tree_from_rpn(rpn, make_node=TreeNode):
+    """Строит дерево разбора по RPN.
+
+    make_node - фабрика узлов, например NodeTable().make для интернированного дерева."""
     stack = []
     for token in rpn:
         if token == '*':
             if not stack:
                 raise ValueError("Недостаточно операндов для '*'.")
-            node = TreeNode('*', left=stack.pop())
+            node = make_node('*', left=stack.pop())
             stack.append(node)
         elif token == '.':
             if len(stack) < 2:
                 raise ValueError("Недостаточно операндов для '.'.")
             right = stack.pop()
             left = stack.pop()
-            node = TreeNode('.', left=left, right=right)
+            node = make_node('.', left=left, right=right)
             stack.append(node)
         elif token == '|':
             if len(stack) < 2:
                 raise ValueError("Недостаточно операндов для '|'.")
             right = stack.pop()
             left = stack.pop()
-            node = TreeNode('|', left=left, right=right)
+            node = make_node('|', left=left, right=right)
             stack.append(node)
         else:  # Это буква или пустое слово (ε)
-            stack.append(TreeNode(token))
+            stack.append(make_node(token))
 
     if len(stack) != 1:
         raise ValueError("Некорректное выражение, стек не пуст после обработки RPN.")
@@ -119,45 +677,326 @@ def build_parse_tree_from_rpn(rpn):
     return stack[0] if stack else None
 
 
+# Коды операций плоского дерева
+OP_LITERAL, OP_CONCAT, OP_UNION, OP_STAR = 0, 1, 2, 3
+FLAT_OPCODES = {'.': OP_CONCAT, '|': OP_UNION, '*': OP_STAR}
+
+
+class FlatTree:
+    """Плоское дерево разбора в виде параллельных массивов (структура массивов).
+
+    Узел i описывается opcodes[i], left[i], right[i] и literal[i] (индекс метки
+    в literals); отсутствующий потомок или метка - это -1. Узлы хранятся в
+    порядке RPN, поэтому потомки всегда раньше родителя, а корень - последний."""
+
+    def __init__(self):
+        self.opcodes = array('b')
+        self.left = array('i')
+        self.right = array('i')
+        self.literal = array('i')
+        self.literals = []
+        self._literal_ids = {}
+
+    def __len__(self):
+        return len(self.opcodes)
+
+    @property
+    def root(self):
+        return len(self.opcodes) - 1
+
+    def add(self, opcode, left=-1, right=-1, literal=-1):
+        self.opcodes.append(opcode)
+        self.left.append(left)
+        self.right.append(right)
+        self.literal.append(literal)
+        return len(self.opcodes) - 1
+
+    def add_literal(self, label):
+        literal_id = self._literal_ids.get(label)
+        if literal_id is None:
+            literal_id = self._literal_ids[label] = len(self.literals)
+            self.literals.append(label)
+        return self.add(OP_LITERAL, literal=literal_id)
+
+    def make(self, label, left=None, right=None):
+        """Фабрика узлов в духе TreeNode для build_parse_tree_from_rpn и parse_regex.
+
+        Возвращает индекс добавленного узла."""
+        if left is not None and label in FLAT_OPCODES:
+            return self.add(FLAT_OPCODES[label], left, -1 if right is None else right)
+        return self.add_literal(label)
+
+    def label(self, index):
+        opcode = self.opcodes[index]
+        if opcode == OP_LITERAL:
+            return self.literals[self.literal[index]]
+        return '.|*'[opcode - 1]
+
+    def nbytes(self):
+        """Объём памяти, занимаемый массивами узлов."""
+        return sum(len(a) * a.itemsize for a in (self.opcodes, self.left, self.right, self.literal))
+
+
+def build_flat_tree_from_rpn(rpn):
+    """Строит FlatTree непосредственно по RPN, без промежуточных объектов-узлов."""
+    tree = FlatTree()
+    build_parse_tree_from_rpn(rpn, tree.make)
+    return tree
+
+
+PRECEDENCE = {'*': 3, '.': 2, '|': 1}
+
+
+@contextlib.contextmanager
+def gc_paused():
+    """Приостанавливает циклический сборщик мусора на время построения дерева.
+
+    Проходы сборщика по растущему числу узлов делают разбор больших выражений
+    сверхлинейным, а циклов в деревьях разбора нет."""
+    was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if was_enabled:
+            gc.enable()
+
+
+def parse_regex(regex, make_node=TreeNode):
+    """Однопроходный разбор: строка сразу превращается в дерево.
+
+    Повторяет решения tokenize, to_rpn и build_parse_tree_from_rpn, поэтому
+    деревья совпадают, но списки токенов и RPN не создаются: явная конкатенация
+    вставляется на лету, а операторы применяются к стеку поддеревьев сразу при
+    выталкивании из стека операторов."""
+    operands = []
+    operators = []
+    precedence = PRECEDENCE.get
+
+    def apply(token):
+        if token == '*':
+            if not operands:
+                raise ValueError("Недостаточно операндов для '*'.")
+            operands.append(make_node('*', left=operands.pop()))
+        elif token == '.' or token == '|':
+            if len(operands) < 2:
+                raise ValueError(f"Недостаточно операндов для '{token}'.")
+            right = operands.pop()
+            left = operands.pop()
+            operands.append(make_node(token, left=left, right=right))
+        else:
+            operands.append(make_node(token))
+
+    def push_operator(token):
+        token_precedence = precedence(token, 0)
+        while operators and operators[-1] != '(' and precedence(operators[-1], 0) >= token_precedence:
+            apply(operators.pop())
+        operators.append(token)
+
+    last = len(regex) - 1
+    with gc_paused():
+        for i, char in enumerate(regex):
+            if char.isalnum() or char == 'ε':
+                operands.append(make_node(char))
+            elif char == '(':
+                operators.append(char)
+            elif char == ')':
+                while operators and operators[-1] != '(':
+                    apply(operators.pop())
+                if not operators:
+                    raise ValueError("Лишняя закрывающая скобка ')'.")
+                operators.pop()  # Удаляем '('
+            else:  # Операторы
+                push_operator(char)
+
+            # Явный оператор конкатенации между соседними токенами
+            if char != '(' and char != '|' and i < last and regex[i + 1] not in ')*|':
+                push_operator('.')
+
+        while operators:
+            apply(operators.pop())
+
+    if len(operands) != 1:
+        raise ValueError("Некорректное выражение, стек не пуст после обработки RPN.")
+
+    return operands[0]
+
+
+def parse_regex_flat(regex):
+    """Однопроходный разбор строки сразу в FlatTree."""
+    tree = FlatTree()
+    parse_regex(regex, tree.make)
+    return tree
+
+
+def validate_regex(regex):
+    """Проверяет выражение (is_valid_regex, validate_empty_groups); ошибка - ValueError."""
+    if not is_valid_regex(regex):
+        raise ValueError(f"Некорректное регулярное выражение '{regex}'.")
+    validate_empty_groups(regex)
+
+
+def parse_validated(regex, make_node=TreeNode):
+    """Проверяет выражение (validate_regex) и строит дерево разбора."""
+    validate_regex(regex)
+    return parse_regex(regex, make_node)
+
+
+class ParseCache:
+    """Потокобезопасный LRU-кэш деревьев разбора по исходному тексту выражения.
+
+    Ограничен и числом записей, и оценкой занимаемой памяти. Деревья из кэша
+    общие для всех вызывающих, изменять их нельзя. Ошибки разбора не кэшируются."""
+
+    # Оценка размера TreeNode вместе со словарём атрибутов и число узлов на символ
+    NODE_BYTES = 160
+    NODES_PER_CHAR = 2
+
+    def __init__(self, max_entries=4096, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def estimate_bytes(self, regex):
+        return sys.getsizeof(regex) + len(regex) * self.NODES_PER_CHAR * self.NODE_BYTES
+
+    def parse(self, regex):
+        """Возвращает дерево разбора из кэша или строит его через parse_validated."""
+        tree = self.get(regex)
+        if tree is None:
+            # Разбор вне блокировки, чтобы потоки не ждали друг друга
+            tree = self.put(regex, parse_validated(regex))
+        return tree
+
+    def get(self, regex):
+        """Дерево разбора из кэша или None (промах учитывается в статистике)."""
+        with self._lock:
+            entry = self._entries.get(regex)
+            if entry is not None:
+                self._entries.move_to_end(regex)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+        return None
+
+    def put(self, regex, tree):
+        """Сохраняет проверенное дерево разбора и возвращает дерево, которое
+        теперь лежит в кэше (если другой поток успел раньше - его дерево)."""
+        size = self.estimate_bytes(regex)
+        if size > self.max_bytes:
+            return tree
+
+        with self._lock:
+            entry = self._entries.get(regex)
+            if entry is not None:  # Другой поток успел добавить то же выражение
+                return entry[0]
+            self._entries[regex] = (tree, size)
+            self.current_bytes += size
+            while len(self._entries) > self.max_entries or self.current_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+                self.evictions += 1
+        return tree
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self.current_bytes,
+                    'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+    def __len__(self):
+        return len(self._entries)
+
+
+parse_cache = ParseCache()
+
+
 def display_tree(node, depth=0):
     """Функция для вывода дерева в консоль."""
-    indent = "  " * depth
-    print(indent + node.label)
-    if node.left:
-        display_tree(node.left, depth + 1)
-    if node.right:
-        display_tree(node.right, depth + 1)
+    # Явный стек вместо рекурсии: глубокие деревья не упираются в RecursionError
+    stack = [(node, depth)]
+    while stack:
+        node, depth = stack.pop()
+        print("  " * depth + node.label)
+        if node.right:
+            stack.append((node.right, depth + 1))
+        if node.left:
+            stack.append((node.left, depth + 1))
+
+
+def display_flat_tree(tree):
+    """Выводит плоское дерево в консоль в том же виде, что и display_tree."""
+    stack = [(tree.root, 0)]
+    while stack:
+        index, depth = stack.pop()
+        print("  " * depth + tree.label(index))
+        if tree.right[index] >= 0:
+            stack.append((tree.right[index], depth + 1))
+        if tree.left[index] >= 0:
+            stack.append((tree.left[index], depth + 1))
+
+
+def add_graph_node(graph, node_id, label, parent_id=None):
+    """Добавляет в граф Graphviz один узел и ребро от родителя."""
+    # Выбор цвета узла в зависимости от метки
+    if label == '|':
+        node_color = 'lightblue'  # Цвет для альтернативы
+    elif label == '.':
+        node_color = 'lightgreen'  # Цвет для конкатенации
+    elif label == '*':
+        node_color = 'lightyellow'  # Цвет для итерации
+    else:
+        node_color = 'lightgrey'  # Цвет для букв или пустых меток
+
+    # Узлы
+    graph.node(f'{node_id}', label=label, shape='ellipse', style='filled', color=node_color,
+               fontcolor='black', fontsize='14', width='1.2', height='0.8')
+
+    # Связи
+    if parent_id is not None:
+        graph.edge(f'{parent_id}', f'{node_id}', color='black', arrowsize='0.7', penwidth='2')
 
 
 def add_nodes_edges(node, graph, node_id=0, parent_id=None):
     """Функция для добавления узлов и рёбер в граф Graphviz."""
-    if node is not None:
+    # Узлы нумеруются в прямом порядке обхода (узел, левое, правое поддерево)
+    stack = [(node, parent_id)] if node is not None else []
+    while stack:
+        node, parent_id = stack.pop()
         current_id = node_id
         node_id += 1
 
-        # Выбор цвета узла в зависимости от метки
-        if node.label == '|':
-            node_color = 'lightblue'  # Цвет для альтернативы
-        elif node.label == '.':
-            node_color = 'lightgreen'  # Цвет для конкатенации
-        elif node.label == '*':
-            node_color = 'lightyellow'  # Цвет для итерации
-        else:
-            node_color = 'lightgrey'  # Цвет для букв или пустых меток
+        add_graph_node(graph, current_id, node.label, parent_id)
 
-        # Узлы
-        graph.node(f'{current_id}', label=node.label, shape='ellipse', style='filled', color=node_color,
-                   fontcolor='black', fontsize='14', width='1.2', height='0.8')
+        if node.right:
+            stack.append((node.right, current_id))
+        if node.left:
+            stack.append((node.left, current_id))
 
-        # Связи
-        if parent_id is not None:
-            graph.edge(f'{parent_id}', f'{current_id}', color='black', arrowsize='0.7', penwidth='2')
+    return node_id
 
-        if node.left:
-            node_id = add_nodes_edges(node.left, graph, node_id, current_id)
-        if node.right:
-            node_id = add_nodes_edges(node.right, graph, node_id, current_id)
 
+def add_flat_nodes_edges(tree, graph):
+    """Добавляет узлы и рёбра плоского дерева в граф Graphviz (нумерация как в add_nodes_edges)."""
+    node_id = 0
+    stack = [(tree.root, None)]
+    while stack:
+        index, parent_id = stack.pop()
+        add_graph_node(graph, node_id, tree.label(index), parent_id)
+        if tree.right[index] >= 0:
+            stack.append((tree.right[index], node_id))
+        if tree.left[index] >= 0:
+            stack.append((tree.left[index], node_id))
+        node_id += 1
     return node_id
 
 
@@ -165,7 +1004,10 @@ def create_graph(node):
     """Функция для создания графа с помощью Graphviz."""
     graph = Digraph(comment='Parse Tree')
     graph.attr(size='10,10', rankdir='TB', fontsize='16', fontname='Arial', dpi='300')  # Настройки графа
-    add_nodes_edges(node, graph)
+    if isinstance(node, FlatTree):
+        add_flat_nodes_edges(node, graph)
+    else:
+        add_nodes_edges(node, graph)
     return graph
 
 
@@ -181,31 +1023,29 @@ def verify_associativity(node):
     """Функция для проверки ассоциативности регулярных выражений."""
     solver = Solver()
 
-    def add_constraints(node, level=0):
-        if node.label == '|':
-            if node.left:
-                add_constraints(node.left, level + 1)
-            if node.right:
-                add_constraints(node.right, level + 1)
-            left_expr = Bool(f'left_{level}')
-            right_expr = Bool(f'right_{level}')
-            solver.add(Or(left_expr, right_expr))
-        elif node.label == '.':
-            if node.left:
-                add_constraints(node.left, level + 1)
-            if node.right:
-                add_constraints(node.right, level + 1)
-            left_expr = Bool(f'left_{level}')
-            right_expr = Bool(f'right_{level}')
-            solver.add(And(left_expr, right_expr))
-        elif node.label == '*':
-            if node.left:
-                add_constraints(node.left, level + 1)
-            expr = Bool(f'expr_{level}')
-            solver.add(expr)
-        else:
-            expr = Bool(f'expr_{level}')
-            solver.add(expr)
+    def add_constraints(root):
+        # Обратный порядок обхода с явным стеком: ограничения потомков добавляются
+        # раньше ограничения узла, как и при рекурсивном обходе
+        stack = [(root, 0, False)]
+        while stack:
+            node, level, expanded = stack.pop()
+            if not expanded and node.label in ('|', '.', '*'):
+                stack.append((node, level, True))
+                if node.label != '*' and node.right:
+                    stack.append((node.right, level + 1, False))
+                if node.left:
+                    stack.append((node.left, level + 1, False))
+            elif node.label == '|':
+                left_expr = Bool(f'left_{level}')
+                right_expr = Bool(f'right_{level}')
+                solver.add(Or(left_expr, right_expr))
+            elif node.label == '.':
+                left_expr = Bool(f'left_{level}')
+                right_expr = Bool(f'right_{level}')
+                solver.add(And(left_expr, right_expr))
+            else:
+                expr = Bool(f'expr_{level}')
+                solver.add(expr)
 
     add_constraints(node)
 
@@ -215,40 +1055,2022 @@ def verify_associativity(node):
         print(f"Associativity is not satisfied for node: {node.label}")
 
 
+class FragmentWriter:
+    """Буферизованная запись текстовых фрагментов в файловый объект.
+
+    Поток может быть текстовым или двоичным (тогда текст кодируется в encoding);
+    по умолчанию вид потока определяется по io.TextIOBase. Фрагменты копятся до
+    buffer_size символов, поэтому число вызовов stream.write невелико, а память
+    не зависит от общего объёма вывода."""
+
+    def __init__(self, stream, binary=None, encoding='utf-8', buffer_size=1 << 16):
+        self.stream = stream
+        self.binary = not isinstance(stream, io.TextIOBase) if binary is None else binary
+        self.encoding = encoding
+        self.buffer_size = buffer_size
+        self._buffer = []
+        self._size = 0
+
+    def write(self, fragment):
+        self._buffer.append(fragment)
+        self._size += len(fragment)
+        if self._size >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            data = ''.join(self._buffer)
+            self.stream.write(data.encode(self.encoding) if self.binary else data)
+            self._buffer.clear()
+            self._size = 0
+
+
+# Значения при построении SMT2 представления снизу вверх:
+#   str без '(' в начале - склеенные метки листов цепочки конкатенаций (литерал);
+#     метка ε остаётся в литерале и убирается при переводе литерала в (str.to_re "...");
+#   list - длинный литерал: вложенные списки его частей, без копирования при склейке;
+#   str, начинающаяся с '(' - готовый терм;
+#   tuple - длинный терм: вложенные кортежи фрагментов текста.
+# Списки и кортежи не изменяются после создания, поэтому значения общих поддеревьев
+# можно использовать повторно. Короткие значения склеиваются как строки: на обычных
+# выражениях это быстрее всего, а длинные не копируются на каждом уровне дерева.
+SMT2_ROPE_THRESHOLD = 512
+# Рекурсия идёт отрезками по SMT2_RECURSION_STEP уровней: на границе отрезка длинная
+# левая цепочка проходится циклом (_smt2_chain), а её правые ветви - снова рекурсией.
+# После SMT2_RECURSION_SEGMENTS отрезков работает _smt2_iterative, так что стек
+# вызовов ограничен независимо от формы дерева
+SMT2_RECURSION_STEP = 64
+SMT2_RECURSION_SEGMENTS = 4
+_SMT2_SEGMENT_ENDS = frozenset(range(SMT2_RECURSION_STEP, (SMT2_RECURSION_STEP + 1) * SMT2_RECURSION_SEGMENTS,
+                                     SMT2_RECURSION_STEP + 1))
+_SMT2_LAST_SEGMENT_END = max(_SMT2_SEGMENT_ENDS)
+
+
+def _smt2_term(value):
+    """Готовый терм (str или tuple) по значению любого вида."""
+    if type(value) is str:
+        return value if value[0] == '(' else f'(str.to_re "{value.replace(EPSILON, "")}")'
+    if type(value) is list:
+        return f'(str.to_re "{_smt2_join(value).replace(EPSILON, "")}")'
+    return value
+
+
+def _smt2_join(value):
+    """Текст вложенных списков (литерала) или кортежей (терма) слева направо."""
+    parts = []
+    stack = [value]
+    while stack:
+        item = stack.pop()
+        if type(item) is str:
+            parts.append(item)
+        else:
+            stack.extend(reversed(item))
+    return ''.join(parts)
+
+
+def _smt2_combine(label, left, right=None):
+    """Значение узла label по значениям потомков (right не нужен для '*')."""
+    left_type = type(left)
+    if label == '*':
+        if left_type is str:
+            if left[0] != '(':
+                left = f'(str.to_re "{left.replace(EPSILON, "")}")'
+            if len(left) < SMT2_ROPE_THRESHOLD:
+                return f'(re.* {left})'
+        return ('(re.* ', _smt2_term(left), ')')
+    right_type = type(right)
+    if left_type is str and right_type is str and len(left) + len(right) < SMT2_ROPE_THRESHOLD:
+        if left[0] != '(':
+            if label == '.' and right[0] != '(':
+                return left + right
+            left = f'(str.to_re "{left.replace(EPSILON, "")}")'
+        if right[0] != '(':
+            right = f'(str.to_re "{right.replace(EPSILON, "")}")'
+        return f'(re.++ {left} {right})' if label == '.' else f'(re.union {left} {right})'
+    # Конкатенация двух литералов остаётся литералом
+    if label == '.' and (left_type is list or left_type is str and left[0] != '(') \
+            and (right_type is list or right_type is str and right[0] != '('):
+        return [left, right]
+    return ('(re.++ ' if label == '.' else '(re.union ', _smt2_term(left), ' ', _smt2_term(right), ')')
+
+
+def _smt2_recursive(node, depth=0):
+    """Значение поддерева одной строкой: литерал или терм.
+
+    Обратный обход рекурсией со склейкой строк - самый быстрый путь для обычных
+    выражений; depth - число уровней рекурсии над узлом, на границах отрезков
+    поддерево передаётся _smt2_deep."""
+    label = node.label
+    if label == '.' or label == '|':
+        if depth >= SMT2_RECURSION_STEP and depth in _SMT2_SEGMENT_ENDS:
+            return _smt2_deep(node, depth)
+        left = _smt2_recursive(node.left, depth + 1)
+        right = _smt2_recursive(node.right, depth + 1)
+        if left[0] != '(':
+            if label == '.' and right[0] != '(':
+                return left + right
+            left = f'(str.to_re "{left.replace(EPSILON, "")}")'
+        if right[0] != '(':
+            right = f'(str.to_re "{right.replace(EPSILON, "")}")'
+        return f'(re.++ {left} {right})' if label == '.' else f'(re.union {left} {right})'
+    if label == '*':
+        if depth >= SMT2_RECURSION_STEP and depth in _SMT2_SEGMENT_ENDS:
+            return _smt2_deep(node, depth)
+        body = _smt2_recursive(node.left, depth + 1)
+        return f'(re.* {body})' if body[0] == '(' else f'(re.* (str.to_re "{body.replace(EPSILON, "")}"))'
+    return label
+
+
+def _smt2_deep(node, depth):
+    # Поддерево, до которого рекурсия дошла на границе отрезка
+    value = _smt2_iterative(node) if depth == _SMT2_LAST_SEGMENT_END else _smt2_chain(node, depth + 1)
+    return value if type(value) is str else _smt2_join(value)
+
+
+def _smt2_chain(root, depth):
+    """Значение поддерева с длинной левой цепочкой (деревья разбора левоассоциативны):
+    цепочка проходится циклом, правые ветви - рекурсией следующего отрезка с глубины depth."""
+    spine = []
+    node = root
+    while node.left is not None:
+        spine.append(node)
+        node = node.left
+    value = node.label
+    pieces = None  # Части литерала, который ещё растёт вдоль цепочки
+    for parent in reversed(spine):
+        label = parent.label
+        if label == '*':
+            if pieces is not None:
+                value = ''.join(pieces)
+                pieces = None
+            value = _smt2_combine('*', value)
+            continue
+        right = parent.right
+        right = right.label if right.left is None else _smt2_recursive(right, depth)
+        if label == '.' and right[0] != '(' and (pieces is not None or type(value) is str and value[0] != '('):
+            if pieces is None:
+                pieces = [value]
+            pieces.append(right)
+            continue
+        if pieces is not None:
+            value = ''.join(pieces)
+            pieces = None
+        value = _smt2_combine(label, value, right)
+    return value if pieces is None else ''.join(pieces)
+
+
+def _smt2_iterative(root, memo=None):
+    """Обратный обход с явным стеком; memo - значения уже переведённых узлов
+    интернированного дерева, общие поддеревья переводятся один раз."""
+    values = []
+    stack = [(root, False)]
+    while stack:
+        node, expanded = stack.pop()
+        label = node.label
+        if expanded:
+            if label == '*':
+                value = _smt2_combine('*', values.pop())
+            else:
+                right = values.pop()
+                value = _smt2_combine(label, values.pop(), right)
+            if memo is not None:
+                memo[node] = value
+            values.append(value)
+        elif memo is not None and node in memo:
+            values.append(memo[node])
+        elif label == '.' or label == '|':
+            stack += ((node, True), (node.right, False), (node.left, False))
+        elif label == '*':
+            stack += ((node, True), (node.left, False))
+        else:
+            values.append(label)
+    return values.pop()
+
+
 class SMT2Converter:
+    # Версия формата вывода: увеличивается при любом изменении генерируемого SMT2,
+    # чтобы записи дискового кэша старого формата не использовались
+    # (2 - ε выводится пустой строкой во всех путях, а не (str.to_re "ε"))
+    FORMAT_VERSION = 2
+
     def __init__(self, root):
         self.root = root
+        # Значения узлов интернированного дерева: каждое общее поддерево
+        # преобразуется один раз
+        self._cache = {}
 
     def convert(self):
-        return self._convert_node(self.root)
-
-    def _convert_node(self, node):
-        # Если это оператор объединения
-        if node.label == '|':
-            return f"(re.union {self._convert_node(node.left)} {self._convert_node(node.right)})"
-        # Если это оператор конкатенации
-        elif node.label == '.':
-            left = self._convert_node(node.left)
-            right = self._convert_node(node.right)
-
-            # Объединяем строки, если оба потомка - листы с одиночными символами или строками
-            if left.startswith('(str.to_re "') and right.startswith('(str.to_re "'):
-                # Извлекаем содержимое строк
-                left_str = left[len('(str.to_re "'): -2]
-                right_str = right[len('(str.to_re "'): -2]
-                # Возвращаем объединенную строку
-                return f'(str.to_re "{left_str + right_str}")'
+        root = self.root
+        if type(root) is TreeNode:
+            value = _smt2_recursive(root)
+            return value if value[0] == '(' else f'(str.to_re "{value.replace(EPSILON, "")}")'
+        fragments = []
+        self.emit(fragments.append)
+        return ''.join(fragments)
+
+    def convert_to(self, stream, binary=None, encoding='utf-8'):
+        """Пишет SMT2 представление в текстовый или двоичный поток по мере построения."""
+        writer = FragmentWriter(stream, binary, encoding)
+        self.emit(writer.write)
+        writer.flush()
+
+    def emit(self, write):
+        """Выдаёт SMT2 представление фрагментами через write за время, линейное по размеру дерева.
+
+        Дерево переводится одним обратным обходом; цепочки конкатенаций из одних
+        листов объединяются в один (str.to_re "...") по дереву, а не по уже
+        построенному тексту."""
+        if isinstance(self.root, NaryNode):
+            self._emit_nary(write)
+            return
+        term = self._term()
+        if type(term) is str:
+            write(term)
+            return
+        stack = [term]
+        while stack:
+            item = stack.pop()
+            if type(item) is str:
+                write(item)
             else:
-                # В случае более сложных выражений, просто объединяем их через re.++
-                return f"(re.++ {left} {right})"
-        # Если это оператор замыкания Клини
-        elif node.label == '*':
-            return f"(re.* {self._convert_node(node.left)})"
-        # Лист дерева - отдельный символ
+                stack.extend(reversed(item))
+
+    def _term(self):
+        # Терм всего двоичного дерева: строка или кортеж фрагментов
+        if isinstance(self.root, InternedNode):
+            return _smt2_term(_smt2_iterative(self.root, self._cache))
+        return _smt2_term(_smt2_recursive(self.root))
+
+    def _emit_nary(self, write):
+        # n-арные узлы выводятся одним термом: (re.union t1 ... tn), (re.++ t1 ... tn);
+        # соседние листы конкатенации сливаются в один (str.to_re "..."), ε - пустая строка
+        stack = [self.root]
+        while stack:
+            item = stack.pop()
+            if type(item) is str:
+                write(item)
+                continue
+            label = item.label
+            if not item.children:
+                write(f'(str.to_re "{self._nary_literal(item)}")')
+            elif label == '*':
+                stack += (')', item.children[0])
+                write('(re.* ')
+            elif label == '|':
+                stack.append(')')
+                for child in reversed(item.children):
+                    stack += (child, ' ')
+                write('(re.union')
+            else:
+                terms = []
+                run = []
+                for child in item.children:
+                    if child.children:
+                        if run:
+                            terms.append(f'(str.to_re "{"".join(run)}")')
+                            run = []
+                        terms.append(child)
+                    else:
+                        run.append(self._nary_literal(child))
+                if run:
+                    terms.append(f'(str.to_re "{"".join(run)}")')
+                if len(terms) == 1:
+                    stack.append(terms[0])
+                    continue
+                stack.append(')')
+                for term in reversed(terms):
+                    stack += (term, ' ')
+                write('(re.++')
+
+    @staticmethod
+    def _nary_literal(node):
+        return '' if node.label == EPSILON else node.label
+
+
+def emit_flat_smt2(tree, write):
+    """Выдаёт SMT2 представление плоского дерева фрагментами через write за линейное время."""
+    opcodes, lefts, rights = tree.opcodes, tree.left, tree.right
+    # Потомки всегда раньше родителя, поэтому признак «одни листы» считается одним проходом
+    pure = bytearray(len(tree))
+    for index, opcode in enumerate(opcodes):
+        if opcode == OP_LITERAL:
+            pure[index] = 1
+        elif opcode == OP_CONCAT:
+            pure[index] = pure[lefts[index]] and pure[rights[index]]
+
+    stack = [tree.root]
+    while stack:
+        item = stack.pop()
+        if type(item) is str:
+            write(item)
+            continue
+        opcode = opcodes[item]
+        if pure[item]:
+            labels = []
+            subtree = [item]
+            while subtree:
+                index = subtree.pop()
+                if opcodes[index] == OP_CONCAT:
+                    subtree.append(rights[index])
+                    subtree.append(lefts[index])
+                else:
+                    labels.append(tree.literals[tree.literal[index]])
+            write(f'(str.to_re "{"".join(labels).replace(EPSILON, "")}")')
+        elif opcode == OP_STAR:
+            stack += (')', lefts[item])
+            write('(re.* ')
         else:
-            return f'(str.to_re "{node.label}")'
+            stack += (')', rights[item], ' ', lefts[item])
+            write('(re.union ' if opcode == OP_UNION else '(re.++ ')
+
+
+def convert_flat_to(tree, stream, binary=None, encoding='utf-8'):
+    """Пишет SMT2 представление плоского дерева в текстовый или двоичный поток."""
+    writer = FragmentWriter(stream, binary, encoding)
+    emit_flat_smt2(tree, writer.write)
+    writer.flush()
+
+
+def convert_flat_to_smt2(tree):
+    """SMT2 представление плоского дерева, совпадающее с выводом SMT2Converter."""
+    fragments = []
+    emit_flat_smt2(tree, fragments.append)
+    return ''.join(fragments)
+
+
+def smt2_format_version(nary=False, simplify=False):
+    """Версия формата вывода режима пакетной обработки: n-арный и упрощённый
+    вывод - другие форматы, их записи в кэше не должны смешиваться с двоичным."""
+    if simplify:
+        return f"{SMT2Converter.FORMAT_VERSION}-simplified-{REWRITE_RULES_VERSION}"
+    if nary:
+        return f"{SMT2Converter.FORMAT_VERSION}-nary"
+    return str(SMT2Converter.FORMAT_VERSION)
+
+
+# Версии формата всех режимов текущей версии программы
+SMT2_FORMAT_VERSIONS = frozenset(smt2_format_version(nary, simplify)
+                                 for nary in (False, True) for simplify in (False, True))
+
+
+class SMT2DiskCache:
+    """Постоянный кэш SMT2 представлений в файле SQLite.
+
+    Ключ - SHA-256 от версии формата SMT2Converter и нормализованного текста
+    выражения; версия хранится и в самой записи. Записи разных режимов
+    (format_version) живут в одном файле рядом, а при открытии удаляются только
+    записи версий, которых больше нет ни у одного режима."""
+
+    # Версия схемы таблиц: файл со старой схемой очищается целиком
+    SCHEMA_VERSION = 2
+
+    def __init__(self, path, format_version=None):
+        self.format_version = smt2_format_version() if format_version is None else str(format_version)
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+        if self._meta('schema_version') != str(self.SCHEMA_VERSION):
+            self.connection.execute("DROP TABLE IF EXISTS smt2")
+            self.connection.execute("DELETE FROM meta")
+            self._set_meta('schema_version', self.SCHEMA_VERSION)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS smt2 "
+                                "(key BLOB PRIMARY KEY, format_version TEXT NOT NULL, value TEXT NOT NULL)")
+        # Таблица просматривается, только когда набор версий изменился с прошлого открытия
+        versions = sorted(SMT2_FORMAT_VERSIONS | {self.format_version})
+        if self._meta('format_versions') != '\n'.join(versions):
+            self.connection.execute(
+                f"DELETE FROM smt2 WHERE format_version NOT IN ({', '.join('?' * len(versions))})", versions)
+            self._set_meta('format_versions', '\n'.join(versions))
+        self.connection.commit()
+
+    def _meta(self, name):
+        row = self.connection.execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
 
+    def _set_meta(self, name, value):
+        self.connection.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (name, str(value)))
 
+    @staticmethod
+    def normalize(regex):
+        return regex.strip()
+
+    def key(self, regex):
+        text = f"{self.format_version}\0{self.normalize(regex)}"
+        return hashlib.sha256(text.encode('utf-8')).digest()
+
+    def get(self, regex):
+        row = self.connection.execute("SELECT value FROM smt2 WHERE key = ?", (self.key(regex),)).fetchone()
+        return row[0] if row else None
+
+    def put_many(self, items):
+        """Сохраняет пары (выражение, SMT2) одной транзакцией."""
+        self.connection.executemany("INSERT OR REPLACE INTO smt2 VALUES (?, ?, ?)",
+                                    [(self.key(regex), self.format_version, smt2_repr)
+                                     for regex, smt2_repr in items])
+        self.connection.commit()
+
+    def put(self, regex, smt2_repr):
+        self.put_many([(regex, smt2_repr)])
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM smt2").fetchone()[0]
+
+    def close(self):
+        self.connection.close()
+
+
+def node_children(node):
+    """Потомки узла любого вида: NaryNode, TreeNode или InternedNode."""
+    children = getattr(node, 'children', None)
+    if children is not None:
+        return children
+    return tuple(child for child in (node.left, node.right) if child is not None)
+
+
+def tree_to_regex(tree):
+    """Записывает дерево разбора обратно в текст выражения.
+
+    Скобки ставятся только там, где без них разбор дал бы другое дерево:
+    вокруг объединения внутри цепочки, вокруг правого потомка того же
+    оператора (разбор левоассоциативен) и вокруг непростого операнда '*'."""
+    results = []
+    stack = [(tree, False)]
+    while stack:
+        node, expanded = stack.pop()
+        children = node_children(node)
+        if not children:
+            results.append(node.label)
+            continue
+        if not expanded:
+            stack.append((node, True))
+            stack.extend((child, False) for child in reversed(children))
+            continue
+        parts = results[-len(children):]
+        del results[-len(children):]
+        label = node.label
+        if label in ('*', '?'):
+            text = parts[0] if not node_children(children[0]) else f"({parts[0]})"
+            results.append(text + label)
+            continue
+        pieces = []
+        for index, (child, text) in enumerate(zip(children, parts)):
+            child_label = child.label if node_children(child) else None
+            if (child_label == '|' and label == '.') or (index and child_label == label):
+                text = f"({text})"
+            pieces.append(text)
+        results.append(('|' if label == '|' else '').join(pieces))
+    return results.pop()
+
+
+def _combine_regex_text(label, left, right):
+    # Пары (текст, оператор корня или None для листа); скобки - как в tree_to_regex
+    text, child_label = left
+    if label == '*':
+        return (text if child_label is None else f"({text})") + '*', '*'
+    right_text, right_label = right
+    if label == '.':
+        if child_label == '|':
+            text = f"({text})"
+        if right_label in ('|', '.'):
+            right_text = f"({right_text})"
+        return text + right_text, '.'
+    if right_label == '|':
+        right_text = f"({right_text})"
+    return f"{text}|{right_text}", '|'
+
+
+class RegexGenerator:
+    """Случайные деревья разбора по взвешенной грамматике R → литерал | ε | R·R | R|R | R*.
+
+    Размер дерева (число узлов) выбирается равномерно от 1 до max_size и
+    урезается так, чтобы дерево поместилось в глубину max_depth; выбор правила
+    учитывает оставшийся размер, поэтому деревья строятся без отбраковки, а
+    текст, полученный tree_to_regex, корректен по построению. При одинаковом
+    seed последовательность выражений одна и та же."""
+
+    DEFAULT_WEIGHTS = {'literal': 1.0, 'ε': 0.0, '.': 3.0, '|': 2.0, '*': 1.0}
+
+    def __init__(self, alphabet='abc', max_depth=6, max_size=30, weights=None, seed=None, make_node=TreeNode):
+        if not alphabet:
+            raise ValueError("Алфавит генератора не может быть пустым.")
+        if max_depth < 0 or max_size < 1:
+            raise ValueError("Глубина должна быть неотрицательной, а размер - не меньше 1.")
+        self.alphabet = alphabet
+        self.max_depth = max_depth
+        self.max_size = max_size
+        self.weights = dict(self.DEFAULT_WEIGHTS)
+        if weights:
+            self.weights.update(weights)
+        self.make_node = make_node
+        self.rng = random.Random(seed)
+
+    def _leaf(self):
+        rng = self.rng
+        literal, epsilon = self.weights['literal'], self.weights['ε']
+        if epsilon > 0 and rng.random() * (literal + epsilon) < epsilon:
+            return EPSILON
+        return rng.choice(self.alphabet)
+
+    def _choices(self):
+        # Литерал - только при размере 1, '*' нужен размер от 2, двоичным операторам - от 3
+        choices = {}
+        for budget in (2, 3):
+            labels = [label for label, need in (('.', 3), ('|', 3), ('*', 2))
+                      if budget >= need and self.weights[label] > 0]
+            choices[budget] = (labels, list(itertools.accumulate(self.weights[label] for label in labels)))
+        return choices
+
+    def _generate(self, leaf, combine):
+        """Общий обход грамматики: leaf(символ) и combine(оператор, левый, правый) собирают результат."""
+        rng = self.rng
+        choices = self._choices()
+        results = []
+        # Элемент стека: (глубина, размер поддерева, оператор для сборки или None)
+        stack = [(0, rng.randint(1, self.max_size), None)]
+        while stack:
+            depth, budget, label = stack.pop()
+            if label == '*':
+                results.append(combine('*', results.pop(), None))
+                continue
+            if label is not None:
+                right = results.pop()
+                left = results.pop()
+                results.append(combine(label, left, right))
+                continue
+            budget = min(budget, 2 ** (self.max_depth - depth + 1) - 1)
+            labels, cumulative = choices[3] if budget >= 3 else choices[2] if budget == 2 else ((), ())
+            if not labels:
+                results.append(leaf(self._leaf()))
+                continue
+            choice = labels[0] if len(labels) == 1 else rng.choices(labels, cum_weights=cumulative)[0]
+            if choice == '*':
+                stack.append((depth, 0, '*'))
+                stack.append((depth + 1, budget - 1, None))
+            else:
+                left = rng.randint(1, budget - 2)
+                stack.append((depth, 0, choice))
+                stack.append((depth + 1, budget - 1 - left, None))
+                stack.append((depth + 1, left, None))
+        return results.pop()
+
+    def tree(self):
+        """Новое случайное дерево разбора."""
+        make_node = self.make_node
+        return self._generate(make_node, lambda label, left, right: make_node(label, left, right))
+
+    def regex(self):
+        """Новое случайное выражение в текстовом виде.
+
+        Текст собирается сразу, по тем же правилам расстановки скобок, что и в
+        tree_to_regex, без построения узлов."""
+        return self._generate(lambda symbol: (symbol, None), _combine_regex_text)[0]
+
+    def __iter__(self):
+        while True:
+            yield self.regex()
+
+
+class StringSampler:
+    """Случайные строки, заведомо соответствующие дереву разбора, и близкие к
+    ним несоответствующие строки.
+
+    Положительные примеры получаются обходом дерева: в '|' выбирается случайная
+    ветвь, '*' повторяется k раз, где k - геометрическое с вероятностью
+    продолжения star_continue, но не больше max_star. Отрицательные примеры -
+    положительные с одной правкой (удаление, вставка, замена символа или
+    перестановка соседних), проверенные ленивым DFA на несоответствие."""
+
+    MUTATION_ATTEMPTS = 20
+
+    def __init__(self, tree, max_star=3, star_continue=0.5, seed=None, rng=None):
+        self.tree = tree
+        self.max_star = max_star
+        self.star_continue = star_continue
+        self.rng = rng if rng is not None else random.Random(seed)
+        alphabet = set()
+        stack = [tree]
+        while stack:
+            node = stack.pop()
+            children = node_children(node)
+            if children:
+                stack.extend(children)
+            elif node.label != EPSILON:
+                alphabet.add(node.label)
+        self.alphabet = ''.join(sorted(alphabet))
+        # Посторонний символ: строка с ним точно не соответствует выражению
+        self.foreign = next(symbol for symbol in '#xyzq@' if symbol not in alphabet)
+        self._matcher = None
+
+    @classmethod
+    def from_regex(cls, regex, **options):
+        return cls(parse_cache.parse(regex), **options)
+
+    @property
+    def matcher(self):
+        if self._matcher is None:
+            self._matcher = LazyDFA(compile_nfa(self.tree))
+        return self._matcher
+
+    def _repeats(self):
+        rng = self.rng
+        count = 0
+        while count < self.max_star and rng.random() < self.star_continue:
+            count += 1
+        return count
+
+    def sample(self):
+        """Строка, соответствующая выражению."""
+        rng = self.rng
+        pieces = []
+        stack = [self.tree]
+        while stack:
+            node = stack.pop()
+            children = node_children(node)
+            if not children:
+                if node.label != EPSILON:
+                    pieces.append(node.label)
+                continue
+            label = node.label
+            if label == '|':
+                stack.append(rng.choice(children))
+            elif label == '*':
+                stack.extend(children[:1] * self._repeats())
+            elif label == '?':
+                if rng.random() < 0.5:
+                    stack.append(children[0])
+            else:
+                stack.extend(reversed(children))
+        return ''.join(pieces)
+
+    def near_miss(self, text=None):
+        """Строка, не соответствующая выражению и отличающаяся одной правкой от
+        положительного примера text (или нового примера)."""
+        rng = self.rng
+        if text is None:
+            text = self.sample()
+        symbols = self.alphabet or self.foreign
+        matcher = self.matcher
+        for _ in range(self.MUTATION_ATTEMPTS):
+            position = rng.randint(0, len(text))
+            operation = rng.randrange(4) if text else 1
+            if operation == 0 and position < len(text):
+                candidate = text[:position] + text[position + 1:]
+            elif operation == 2 and position < len(text):
+                candidate = text[:position] + rng.choice(symbols) + text[position + 1:]
+            elif operation == 3 and position + 1 < len(text):
+                candidate = text[:position] + text[position + 1] + text[position] + text[position + 2:]
+            else:
+                candidate = text[:position] + rng.choice(symbols) + text[position:]
+            if not matcher.fullmatch(candidate):
+                return candidate
+        position = rng.randint(0, len(text))
+        return text[:position] + self.foreign + text[position:]
+
+    def samples(self, count):
+        """Пачка из count положительных примеров."""
+        sample = self.sample
+        return [sample() for _ in range(count)]
+
+    def examples(self, count, negative_ratio=0.5):
+        """Пачка размеченных примеров (строка, соответствует ли выражению)."""
+        rng = self.rng
+        result = []
+        for _ in range(count):
+            text = self.sample()
+            if rng.random() < negative_ratio:
+                result.append((self.near_miss(text), False))
+            else:
+                result.append((text, True))
+        return result
+
+
+# Виды состояний автомата Томпсона
+NFA_CHAR, NFA_SPLIT, NFA_EPSILON, NFA_MATCH = 0, 1, 2, 3
+
+
+class ThompsonNFA:
+    """Автомат Томпсона в плоских массивах.
+
+    Состояние i: kind[i] - вид, char[i] - код символа (для NFA_MATCH - номер
+    шаблона), out[i] и out1[i] - переходы (out1 только у NFA_SPLIT), -1 - нет
+    перехода. Сопоставление моделирует все состояния одновременно и никогда не
+    откатывается: время O(n·m) для строки длины n и автомата из m состояний."""
+
+    def __init__(self):
+        self.kind = array('b')
+        self.char = array('l')
+        self.out = array('l')
+        self.out1 = array('l')
+        self.start = -1
+
+    def __len__(self):
+        return len(self.kind)
+
+    def add_state(self, kind, char=-1, out=-1, out1=-1):
+        self.kind.append(kind)
+        self.char.append(char)
+        self.out.append(out)
+        self.out1.append(out1)
+        return len(self.kind) - 1
+
+    def closure(self, states, marks, generation):
+        """ε-замыкание: состояния NFA_CHAR и NFA_MATCH, достижимые из states без чтения символа.
+
+        marks - рабочий список отметок длины len(self), generation - номер прохода."""
+        kind, out, out1 = self.kind, self.out, self.out1
+        result = []
+        stack = list(states)
+        while stack:
+            state = stack.pop()
+            if marks[state] == generation:
+                continue
+            marks[state] = generation
+            state_kind = kind[state]
+            if state_kind == NFA_SPLIT:
+                stack.append(out1[state])
+                stack.append(out[state])
+            elif state_kind == NFA_EPSILON:
+                stack.append(out[state])
+            else:
+                result.append(state)
+        return result
+
+    def fullmatch(self, text):
+        """Соответствует ли вся строка text автомату."""
+        kind, char, out = self.kind, self.char, self.out
+        marks = [0] * len(kind)
+        generation = 1
+        current = self.closure((self.start,), marks, generation)
+        for symbol in text:
+            code = ord(symbol)
+            targets = [out[state] for state in current if kind[state] == NFA_CHAR and char[state] == code]
+            if not targets:
+                return False
+            generation += 1
+            current = self.closure(targets, marks, generation)
+        return any(kind[state] == NFA_MATCH for state in current)
+
+
+def compile_nfa(tree, nfa=None, tag=0):
+    """Строит автомат Томпсона по дереву разбора ('.', '|', '*', '?', листы, ε).
+
+    Подходит для TreeNode, InternedNode и NaryNode. Без nfa возвращается новый
+    автомат. Если nfa передан, фрагмент добавляется в существующий автомат, его
+    принимающее состояние получает номер шаблона tag, а возвращается начальное
+    состояние фрагмента."""
+    own = nfa is None
+    if own:
+        nfa = ThompsonNFA()
+    add = nfa.add_state
+    out = nfa.out
+    # Фрагмент - пара (начало, конец); у конца не заполнен переход out
+    fragments = []
+    stack = [(tree, False)]
+    while stack:
+        node, expanded = stack.pop()
+        children = node_children(node)
+        if not expanded:
+            if children:
+                stack.append((node, True))
+                stack.extend((child, False) for child in reversed(children))
+            elif node.label == EPSILON:
+                state = add(NFA_EPSILON)
+                fragments.append((state, state))
+            else:
+                state = add(NFA_CHAR, ord(node.label))
+                fragments.append((state, state))
+            continue
+        parts = fragments[-len(children):]
+        del fragments[-len(children):]
+        label = node.label
+        if label == '.':
+            for (_, end), (start, _) in zip(parts, parts[1:]):
+                out[end] = start
+            fragments.append((parts[0][0], parts[-1][1]))
+        elif label == '|':
+            end = add(NFA_EPSILON)
+            start = parts[-1][0]
+            for part_start, _ in reversed(parts[:-1]):
+                start = add(NFA_SPLIT, out=part_start, out1=start)
+            for _, part_end in parts:
+                out[part_end] = end
+            fragments.append((start, end))
+        elif label in ('*', '?'):
+            body_start, body_end = parts[0]
+            end = add(NFA_EPSILON)
+            split = add(NFA_SPLIT, out=body_start, out1=end)
+            out[body_end] = split if label == '*' else end
+            fragments.append((split, end))
+        else:
+            raise ValueError(f"Неизвестный оператор '{label}' в дереве разбора.")
+    start, end = fragments.pop()
+    out[end] = add(NFA_MATCH, tag)
+    if own:
+        nfa.start = start
+        return nfa
+    return start
+
+
+def compile_regex_nfa(regex):
+    """Проверяет выражение, строит дерево разбора и автомат Томпсона."""
+    return compile_nfa(parse_cache.parse(regex))
+
+
+class LazyDFA:
+    """Детерминированный автомат, строящийся по автомату Томпсона во время сопоставления.
+
+    Состояние DFA - упорядоченный кортеж состояний NFA (их ε-замыкание); переходы
+    вычисляются при первом обращении и запоминаются. Кэш ограничен max_states
+    состояниями: при переполнении он сбрасывается целиком (счётчик flushes), так
+    что память ограничена, а время остаётся линейным по длине строки.
+    Подклассы могут переопределить accepts(), чтобы хранить в состоянии не флаг
+    допуска, а, например, множество сработавших шаблонов."""
+
+    def __init__(self, nfa, max_states=4096):
+        if max_states < 2:
+            raise ValueError("Кэш ленивого DFA должен вмещать хотя бы два состояния.")
+        self.nfa = nfa
+        self.max_states = max_states
+        self.flushes = 0
+        self.states_built = 0
+        self._marks = [0] * len(nfa)
+        self._generation = 0
+        self._reset()
+
+    def _reset(self):
+        self._ids = {}
+        self._sets = []
+        self._moves = []
+        self._accept = []
+        self.start_state = self._add_state(self._closure((self.nfa.start,)))
+
+    def flush(self):
+        """Сбрасывает кэш состояний."""
+        self.flushes += 1
+        self._reset()
+
+    def __len__(self):
+        return len(self._sets)
+
+    def _closure(self, states):
+        self._generation += 1
+        return tuple(sorted(self.nfa.closure(states, self._marks, self._generation)))
+
+    def accepts(self, states):
+        """Значение допуска для состояния DFA из состояний NFA states."""
+        kind = self.nfa.kind
+        return any(kind[state] == NFA_MATCH for state in states)
+
+    def _add_state(self, key):
+        state = len(self._sets)
+        self._ids[key] = state
+        self._sets.append(key)
+        self._moves.append({})
+        self._accept.append(self.accepts(key))
+        self.states_built += 1
+        return state
+
+    def step(self, state, symbol):
+        """Переход по символу; -1 - тупиковое состояние.
+
+        Может сбросить кэш: после вызова прежние номера состояний недействительны."""
+        target = self._moves[state].get(symbol)
+        if target is not None:
+            return target
+        nfa = self.nfa
+        kind, char, out = nfa.kind, nfa.char, nfa.out
+        code = ord(symbol)
+        targets = [out[s] for s in self._sets[state] if kind[s] == NFA_CHAR and char[s] == code]
+        if not targets:
+            self._moves[state][symbol] = -1
+            return -1
+        key = self._closure(targets)
+        target = self._ids.get(key)
+        if target is None:
+            if len(self._sets) >= self.max_states:
+                # Исходное состояние исчезает вместе с кэшем, переход не запоминаем
+                self.flush()
+                return self._add_state(key)
+            target = self._add_state(key)
+        self._moves[state][symbol] = target
+        return target
+
+    def run(self, text):
+        """Состояние после чтения всей строки text или -1."""
+        state = self.start_state
+        moves = self._moves
+        for symbol in text:
+            target = moves[state].get(symbol)
+            if target is None:
+                target = self.step(state, symbol)
+                moves = self._moves
+            if target < 0:
+                return -1
+            state = target
+        return state
+
+    def accept_value(self, text):
+        """Значение accepts() для состояния после чтения строки text."""
+        state = self.run(text)
+        return self._accept[state] if state >= 0 else self.accepts(())
+
+    def fullmatch(self, text):
+        """Соответствует ли вся строка text автомату."""
+        return bool(self.accept_value(text))
+
+
+class MultiPatternDFA(LazyDFA):
+    """Ленивый DFA объединённого автомата: допуск состояния - множество номеров шаблонов."""
+
+    def accepts(self, states):
+        kind, char = self.nfa.kind, self.nfa.char
+        return frozenset(char[state] for state in states if kind[state] == NFA_MATCH)
+
+
+class MultiPatternMatcher:
+    """Проверка строки сразу по библиотеке выражений за один проход.
+
+    Все шаблоны компилируются в один автомат Томпсона; принимающее состояние
+    каждого помечено номером шаблона, а общее начало - цепочка NFA_SPLIT.
+    Поверх строится ленивый DFA, состояния которого хранят множества сработавших
+    шаблонов, так что стоимость проверки почти не зависит от числа шаблонов."""
+
+    def __init__(self, patterns, max_states=65536):
+        self.patterns = list(patterns)
+        if not self.patterns:
+            raise ValueError("Нужен хотя бы один шаблон.")
+        nfa = ThompsonNFA()
+        starts = []
+        for tag, pattern in enumerate(self.patterns):
+            tree = parse_cache.parse(pattern) if isinstance(pattern, str) else pattern
+            starts.append(compile_nfa(tree, nfa, tag))
+        start = starts[-1]
+        for pattern_start in reversed(starts[:-1]):
+            start = nfa.add_state(NFA_SPLIT, out=pattern_start, out1=start)
+        nfa.start = start
+        self.nfa = nfa
+        self.dfa = MultiPatternDFA(nfa, max_states)
+
+    def match(self, text):
+        """Множество номеров шаблонов, которым полностью соответствует строка text."""
+        return self.dfa.accept_value(text)
+
+    def match_patterns(self, text):
+        """Сработавшие шаблоны в порядке их задания."""
+        return [self.patterns[tag] for tag in sorted(self.match(text))]
+
+
+@functools.lru_cache(maxsize=256)
+def compile_lazy_dfa(regex, max_states=4096):
+    """Ленивый DFA для выражения (запоминается для повторных проверок)."""
+    return LazyDFA(compile_regex_nfa(regex), max_states)
+
+
+def fullmatch(regex, text):
+    """Быстрая проверка полного соответствия строки выражению без откатов."""
+    return compile_lazy_dfa(regex).fullmatch(text)
+
+
+def build_dfa(nfa):
+    """Строит полный DFA по автомату Томпсона конструкцией подмножеств.
+
+    Каждому символу алфавита выражения соответствует свой класс 1..k, класс 0 -
+    все прочие символы. Возвращает (alphabet, table, accept): table - список
+    строк переходов по классам, -1 - тупиковое состояние; начальное состояние 0."""
+    kind, char, out = nfa.kind, nfa.char, nfa.out
+    alphabet = ''.join(sorted({chr(char[state]) for state in range(len(nfa)) if kind[state] == NFA_CHAR}))
+    classes = {ord(symbol): index for index, symbol in enumerate(alphabet, 1)}
+    marks = [0] * len(nfa)
+    generation = 1
+    start = tuple(sorted(nfa.closure((nfa.start,), marks, generation)))
+    ids = {start: 0}
+    sets = [start]
+    table = []
+    accept = []
+    for key in sets:
+        row = [-1] * (len(alphabet) + 1)
+        moves = {}
+        for state in key:
+            if kind[state] == NFA_CHAR:
+                moves.setdefault(classes[char[state]], []).append(out[state])
+        # В автомате MultiPatternMatcher в подмножестве может быть несколько MATCH
+        accept.append(any(kind[state] == NFA_MATCH for state in key))
+        for symbol_class, targets in moves.items():
+            generation += 1
+            target = tuple(sorted(nfa.closure(targets, marks, generation)))
+            target_id = ids.get(target)
+            if target_id is None:
+                target_id = ids[target] = len(sets)
+                sets.append(target)
+            row[symbol_class] = target_id
+        table.append(row)
+    return alphabet, table, accept
+
+
+def minimize_dfa(table, accept):
+    """Минимизация Хопкрофта полного DFA вида build_dfa.
+
+    Тупиковое состояние (-1) участвует как обычное; состояния, из которых
+    недостижим допуск, сливаются с ним. Новые номера выдаются обходом в ширину
+    от начального состояния. Возвращает (table, accept)."""
+    count = len(table)
+    classes = len(table[0])
+    dead = count
+    inverse = [[[] for _ in range(count + 1)] for _ in range(classes)]
+    for state, row in enumerate(table):
+        for symbol_class, target in enumerate(row):
+            inverse[symbol_class][dead if target < 0 else target].append(state)
+    for symbol_class in range(classes):
+        inverse[symbol_class][dead].append(dead)
+    accepting = {state for state in range(count) if accept[state]}
+    blocks = [block for block in (accepting, set(range(count + 1)) - accepting) if block]
+    block_of = [0] * (count + 1)
+    for index, block in enumerate(blocks):
+        for state in block:
+            block_of[state] = index
+    pending = set(range(len(blocks)))
+    while pending:
+        splitter = list(blocks[pending.pop()])
+        for symbol_class in range(classes):
+            predecessors = {}
+            for target in splitter:
+                for state in inverse[symbol_class][target]:
+                    predecessors.setdefault(block_of[state], set()).add(state)
+            for index, inside in predecessors.items():
+                block = blocks[index]
+                if len(inside) == len(block):
+                    continue
+                block -= inside
+                new_index = len(blocks)
+                blocks.append(inside)
+                for state in inside:
+                    block_of[state] = new_index
+                if index in pending or len(inside) <= len(block):
+                    pending.add(new_index)
+                else:
+                    pending.add(index)
+    dead_block = block_of[dead]
+    numbers = {block_of[0]: 0}
+    order = [block_of[0]]
+    representatives = {}
+    for state in range(count):
+        representatives.setdefault(block_of[state], state)
+    minimal_table = []
+    minimal_accept = []
+    for block in order:
+        row = []
+        for target in table[representatives[block]]:
+            target_block = dead_block if target < 0 else block_of[target]
+            if target_block == dead_block:
+                row.append(-1)
+                continue
+            number = numbers.get(target_block)
+            if number is None:
+                number = numbers[target_block] = len(order)
+                order.append(target_block)
+            row.append(number)
+        minimal_table.append(row)
+        minimal_accept.append(bool(accept[representatives[block]]))
+    return minimal_table, minimal_accept
+
+
+class DenseDFA:
+    """Минимальный DFA с плотной таблицей переходов в array('i').
+
+    Состояние хранится как смещение его строки (номер, умноженный на число
+    классов): переход по классу c - table[state + c], -1 - тупик; начальное
+    состояние 0. Таблицу можно сохранить в файл и отобразить обратно
+    через mmap без повторного разбора выражения."""
+
+    MAGIC = b'RDFA'
+    FORMAT_VERSION = 1
+    # magic, версия, порядок байтов (0 - little, 1 - big), число состояний, число классов, длина алфавита в байтах
+    HEADER = struct.Struct('<4sHHIII')
+
+    def __init__(self, alphabet, table, accept):
+        self.alphabet = alphabet
+        self.classes = len(alphabet) + 1
+        self.class_of = {symbol: index for index, symbol in enumerate(alphabet, 1)}
+        self.table = table
+        self.accept = accept
+        self._buffer = None
+        self._numpy_tables = None
+        # Для ASCII-алфавита строки переводятся в коды классов одним bytes.translate
+        self.byte_classes = None
+        if alphabet.isascii():
+            byte_classes = bytearray(256)
+            for symbol, index in self.class_of.items():
+                byte_classes[ord(symbol)] = index
+            self.byte_classes = bytes(byte_classes)
+
+    @classmethod
+    def from_nfa(cls, nfa):
+        alphabet, table, accept = build_dfa(nfa)
+        table, accept = minimize_dfa(table, accept)
+        classes = len(alphabet) + 1
+        offsets = array('i', (target * classes if target >= 0 else -1
+                              for target in itertools.chain.from_iterable(table)))
+        return cls(alphabet, offsets, bytes(accept))
+
+    @classmethod
+    def from_regex(cls, regex):
+        return cls.from_nfa(compile_regex_nfa(regex))
+
+    def __len__(self):
+        return len(self.accept)
+
+    def fullmatch(self, text):
+        """Соответствует ли вся строка text автомату."""
+        table, classes, class_of = self.table, self.classes, self.class_of
+        state = 0
+        for symbol in text:
+            state = table[state + class_of.get(symbol, 0)]
+            if state < 0:
+                return False
+        return bool(self.accept[state // classes])
+
+    def class_codes(self, text):
+        """Коды классов символов строки или байтовой строки text."""
+        if self.byte_classes is not None:
+            if isinstance(text, str):
+                text = text.encode('utf-8', 'surrogatepass')
+            return text.translate(self.byte_classes)
+        if not isinstance(text, str):
+            text = bytes(text).decode('utf-8')
+        class_of = self.class_of
+        return [class_of.get(symbol, 0) for symbol in text]
+
+    def match_codes(self, codes):
+        """1, если последовательность кодов классов допускается, иначе 0."""
+        table = self.table
+        state = 0
+        for symbol_class in codes:
+            state = table[state + symbol_class]
+            if state < 0:
+                return 0
+        return 1 if self.accept[state // self.classes] else 0
+
+    def match_chunk(self, strings):
+        """Маска соответствия для списка строк; повторяющиеся строки проверяются один раз."""
+        known = {}
+        mask = bytearray(len(strings))
+        for index, text in enumerate(strings):
+            result = known.get(text)
+            if result is None:
+                result = known[text] = self.match_codes(self.class_codes(text))
+            mask[index] = result
+        return mask
+
+    def numpy_tables(self):
+        """Таблицы для match_array: (класс по коду символа, переходы states+1 x classes,
+        признаки допуска). Строка states - тупик; последний элемент таблицы классов -
+        класс 0 для всех кодов больше наибольшего кода алфавита."""
+        if self._numpy_tables is None:
+            states, classes = len(self), self.classes
+            offsets = numpy.asarray(self.table, dtype=numpy.int64).reshape(states, classes)
+            table = numpy.full((states + 1, classes), states, dtype=numpy.intp)
+            table[:states] = numpy.where(offsets >= 0, offsets // classes, states)
+            accept = numpy.zeros(states + 1, dtype=bool)
+            accept[:states] = numpy.frombuffer(bytes(self.accept), dtype=numpy.uint8) != 0
+            class_of_code = numpy.zeros(max(map(ord, self.alphabet), default=0) + 2, dtype=numpy.intp)
+            for symbol, index in self.class_of.items():
+                class_of_code[ord(symbol)] = index
+            self._numpy_tables = class_of_code, table, accept
+        return self._numpy_tables
+
+    def match_array(self, strings):
+        """Маска соответствия (массив bool) для одномерного массива строк NumPy типа
+        str ('U') или, при ASCII-алфавите, bytes ('S').
+
+        Вся пачка проходит автомат одновременно: за шаг - один столбец символов,
+        state = table[state, codes]. Строки упорядочены по убыванию длины, поэтому
+        на шаге i участвуют только первые строки длиннее i, и работа пропорциональна
+        общему числу символов."""
+        class_of_code, table, accept = self.numpy_tables()
+        strings = numpy.ascontiguousarray(strings)
+        unit = numpy.uint32 if strings.dtype.kind == 'U' else numpy.uint8
+        lengths = numpy.char.str_len(strings)
+        order = numpy.argsort(-lengths, kind='stable')
+        units = strings.view(unit).reshape(len(strings), -1)[order]
+        # Число строк длиннее i - позиция -i в неубывающем массиве -длин
+        negative_lengths = -lengths[order]
+        state = numpy.zeros(len(strings), dtype=numpy.intp)
+        last_code = len(class_of_code) - 1
+        for index in range(int(lengths.max(initial=0))):
+            active = int(numpy.searchsorted(negative_lengths, -index))
+            codes = class_of_code[numpy.minimum(units[:active, index], last_code)]
+            state[:active] = table[state[:active], codes]
+        mask = numpy.empty(len(strings), dtype=bool)
+        mask[order] = accept[state]
+        return mask
+
+    def save(self, path):
+        """Сохраняет автомат в файл; таблица выравнивается на 4 байта для mmap."""
+        alphabet = self.alphabet.encode('utf-8')
+        header = self.HEADER.pack(self.MAGIC, self.FORMAT_VERSION, sys.byteorder == 'big',
+                                  len(self), self.classes, len(alphabet))
+        prefix = header + bytes(self.accept) + alphabet
+        with open(path, 'wb') as file:
+            file.write(prefix)
+            file.write(bytes(-len(prefix) % 4))
+            file.write(array('i', self.table).tobytes())
+
+    @classmethod
+    def load(cls, path):
+        """Отображает сохранённый автомат в память; таблица читается прямо из файла."""
+        with open(path, 'rb') as file:
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, big_endian, states, classes, alphabet_size = cls.HEADER.unpack_from(buffer)
+        if magic != cls.MAGIC or version != cls.FORMAT_VERSION:
+            buffer.close()
+            raise ValueError(f"Файл '{path}' не является автоматом формата версии {cls.FORMAT_VERSION}.")
+        if big_endian != (sys.byteorder == 'big'):
+            buffer.close()
+            raise ValueError(f"Автомат '{path}' сохранён с другим порядком байтов.")
+        offset = cls.HEADER.size
+        accept = buffer[offset:offset + states]
+        offset += states
+        alphabet = buffer[offset:offset + alphabet_size].decode('utf-8')
+        offset += alphabet_size
+        offset += -offset % 4
+        table = memoryview(buffer)[offset:offset + states * classes * 4].cast('i')
+        dfa = cls(alphabet, table, accept)
+        dfa._buffer = buffer
+        return dfa
+
+    def close(self):
+        """Освобождает отображение файла, если автомат загружен через load()."""
+        if self._buffer is not None:
+            self.table.release()
+            self._buffer.close()
+            self._buffer = None
+
+
+@functools.lru_cache(maxsize=256)
+def compile_dense_dfa(regex):
+    """Минимальный DFA для выражения (запоминается для повторных проверок)."""
+    return DenseDFA.from_regex(regex)
+
+
+def split_buffer_lines(buffer, separator=None):
+    """Строки буфера с разделителем '\n' (str, bytes, bytearray, memoryview)."""
+    if isinstance(buffer, str):
+        lines = buffer.split(separator or '\n')
+        empty = ''
+    else:
+        lines = bytes(buffer).split(separator or b'\n')
+        empty = b''
+    if lines and lines[-1] == empty:
+        lines.pop()
+    return lines
+
+
+# Код, которым при переводе буфера в классы помечается перевод строки
+LINE_SEPARATOR_CODE = 255
+
+
+def match_many(regex, strings, chunk_size=65536, dfa=None):
+    """Проверяет сразу много строк на полное соответствие выражению.
+
+    strings - список или другой итерируемый набор строк (str или bytes), массив
+    строк NumPy либо буфер со строками через '\n'. Возвращает маску: bytearray
+    из 0 и 1 или массив bool NumPy для входа NumPy. Строки обрабатываются
+    пачками по chunk_size, повторы внутри пачки проверяются один раз. Буфер
+    при ASCII-алфавите переводится в коды классов целиком одним translate,
+    а массив строк NumPy (str или bytes) проверяется пачками целиком в
+    DenseDFA.match_array."""
+    if dfa is None:
+        dfa = compile_dense_dfa(regex)
+    as_numpy = numpy is not None and isinstance(strings, numpy.ndarray)
+    if as_numpy and strings.ndim == 1 and (strings.dtype.kind == 'U' or
+                                           strings.dtype.kind == 'S' and dfa.byte_classes is not None):
+        if not len(strings):
+            return numpy.zeros(0, dtype=bool)
+        return numpy.concatenate([dfa.match_array(strings[start:start + chunk_size])
+                                  for start in range(0, len(strings), chunk_size)])
+    if as_numpy:
+        strings = strings.tolist()
+    elif isinstance(strings, (str, bytes, bytearray, memoryview)):
+        if dfa.byte_classes is None or dfa.classes >= LINE_SEPARATOR_CODE:
+            strings = split_buffer_lines(strings)
+        else:
+            if isinstance(strings, str):
+                strings = strings.encode('utf-8', 'surrogatepass')
+            line_classes = bytearray(dfa.byte_classes)
+            line_classes[ord('\n')] = LINE_SEPARATOR_CODE
+            codes = bytes(strings).translate(line_classes)
+            mask = bytearray()
+            for chunk in iter_chunks(split_buffer_lines(codes, bytes((LINE_SEPARATOR_CODE,))), chunk_size):
+                known = {}
+                for line in chunk:
+                    result = known.get(line)
+                    if result is None:
+                        result = known[line] = dfa.match_codes(line)
+                    mask.append(result)
+            return mask
+    mask = bytearray()
+    for chunk in iter_chunks(strings, chunk_size):
+        mask += dfa.match_chunk(chunk)
+    if as_numpy:
+        return numpy.frombuffer(bytes(mask), dtype=bool)
+    return mask
+
+
+class MatchCounter:
+    """Число строк каждой длины, соответствующих выражению, и равномерный выбор среди них.
+
+    Считается динамическим программированием по минимальному DFA: ways[n][s] -
+    число строк длины n, переводящих состояние s в допускающее. Счётчики -
+    целые числа Python без ограничения разрядности; таблицы для уже
+    посчитанных длин сохраняются и переиспользуются всеми выборками."""
+
+    def __init__(self, dfa):
+        self.dfa = dfa
+        classes = dfa.classes
+        # Переходы по символам алфавита (класс 0 всегда ведёт в тупик)
+        self.moves = [[(dfa.alphabet[symbol_class - 1], dfa.table[offset + symbol_class] // classes)
+                       for symbol_class in range(1, classes) if dfa.table[offset + symbol_class] >= 0]
+                      for offset in range(0, len(dfa) * classes, classes)]
+        self.ways = [[1 if accept else 0 for accept in dfa.accept]]
+
+    @classmethod
+    def from_tree(cls, tree):
+        return cls(DenseDFA.from_nfa(compile_nfa(tree)))
+
+    @classmethod
+    def from_regex(cls, regex):
+        return cls(compile_dense_dfa(regex))
+
+    def table(self, length):
+        """Строка таблицы ways для длины length (достраивается при необходимости)."""
+        ways, moves = self.ways, self.moves
+        while len(ways) <= length:
+            previous = ways[-1]
+            ways.append([sum(previous[target] for _, target in state_moves) for state_moves in moves])
+        return ways[length]
+
+    def count(self, length):
+        """Число соответствующих выражению строк длины length."""
+        return self.table(length)[0]
+
+    def counts(self, max_length):
+        """Числа соответствующих строк длин 0..max_length."""
+        return [self.count(length) for length in range(max_length + 1)]
+
+    def sample(self, length, rng=random):
+        """Равновероятно выбранная строка длины length из соответствующих выражению."""
+        self.table(length)
+        ways, moves = self.ways, self.moves
+        if not ways[length][0]:
+            raise ValueError(f"Выражению не соответствует ни одна строка длины {length}.")
+        state = 0
+        pieces = []
+        for remaining in range(length - 1, -1, -1):
+            choice = rng.randrange(ways[remaining + 1][state])
+            row = ways[remaining]
+            for symbol, target in moves[state]:
+                choice -= row[target]
+                if choice < 0:
+                    pieces.append(symbol)
+                    state = target
+                    break
+        return ''.join(pieces)
+
+    def sample_up_to(self, max_length, rng=random, by_length=False):
+        """Строка длины не больше max_length: равновероятно среди всех таких строк
+        или (by_length) сначала равновероятно среди возможных длин."""
+        counts = self.counts(max_length)
+        if by_length:
+            lengths = [length for length, count in enumerate(counts) if count]
+            if not lengths:
+                raise ValueError(f"Выражению не соответствует ни одна строка длины до {max_length}.")
+            return self.sample(rng.choice(lengths), rng)
+        total = sum(counts)
+        if not total:
+            raise ValueError(f"Выражению не соответствует ни одна строка длины до {max_length}.")
+        choice = rng.randrange(total)
+        for length, count in enumerate(counts):
+            choice -= count
+            if choice < 0:
+                return self.sample(length, rng)
+
+    def corpus(self, count, max_length, seed=0, by_length=False):
+        """Воспроизводимый набор из count соответствующих строк."""
+        rng = random.Random(seed)
+        return [self.sample_up_to(max_length, rng, by_length) for _ in range(count)]
+
+
+EMPTY_SET = '∅'
+
+
+class DerivativeMatcher:
+    """Сопоставление производными Бжозовского прямо по дереву, без построения автомата.
+
+    Дерево и его производные собираются через узлы RewriteEngine конструкторами
+    с упрощениями из таблицы правил (∅ и ε в цепочках, r** → r*, ε* → ε,
+    упорядочивание и удаление повторов в объединении), так что производные
+    остаются небольшими и одинаковые производные - один объект. Полный набор
+    правил не применяется: для разовых проверок он дороже самого сопоставления.
+    Производные (узел, символ) и признак допуска пустой строки запоминаются."""
+
+    def __init__(self, tree, engine=None):
+        self.engine = engine if engine is not None else RewriteEngine()
+        self.empty = self.engine.make(EMPTY_SET)
+        self.epsilon = self.engine.make(EPSILON)
+        self._derivatives = {}
+        self._nullable = {self.empty: False, self.epsilon: True}
+        self.root = self.build(tree)
+
+    @classmethod
+    def from_regex(cls, regex, engine=None):
+        return cls(parse_cache.parse(regex), engine)
+
+    def union(self, parts):
+        branches = set()
+        for part in parts:
+            if part.label == '|':
+                branches.update(part.children)
+            elif part is not self.empty:
+                branches.add(part)
+        if len(branches) < 2:
+            return branches.pop() if branches else self.empty
+        return self.engine.union(sorted(branches, key=self.engine.sort_key))
+
+    def concat(self, parts):
+        items = []
+        for part in parts:
+            if part is self.empty:
+                return self.empty
+            if part.label == '.':
+                items.extend(part.children)
+            elif part is not self.epsilon:
+                items.append(part)
+        return self.engine.concat(items)
+
+    def star(self, node):
+        if node is self.empty or node is self.epsilon:
+            return self.epsilon
+        return node if node.label == '*' else self.engine.make('*', (node,))
+
+    def build(self, tree):
+        """Интернированное упрощённое дерево по дереву любого вида; 'r?' - это ε|r."""
+        results = []
+        stack = [(tree, False)]
+        while stack:
+            node, expanded = stack.pop()
+            children = node_children(node)
+            if not expanded and children:
+                stack.append((node, True))
+                stack.extend((child, False) for child in reversed(children))
+                continue
+            if not children:
+                results.append(self.engine.make(node.label))
+                continue
+            parts = results[-len(children):]
+            del results[-len(children):]
+            label = node.label
+            if label == '.':
+                results.append(self.concat(parts))
+            elif label == '|':
+                results.append(self.union(parts))
+            elif label == '*':
+                results.append(self.star(parts[0]))
+            elif label == '?':
+                results.append(self.union((self.epsilon, parts[0])))
+            else:
+                raise ValueError(f"Неизвестный оператор '{label}' в дереве разбора.")
+        return results.pop()
+
+    def nullable(self, root):
+        """Допускает ли выражение пустую строку."""
+        memo = self._nullable
+        stack = [root]
+        while stack:
+            node = stack[-1]
+            if node in memo:
+                stack.pop()
+                continue
+            label, children = node.label, node.children
+            if not children:
+                memo[node] = False
+            elif label in ('*', '?'):
+                memo[node] = True
+            else:
+                pending = [child for child in children if child not in memo]
+                if pending:
+                    stack.extend(pending)
+                    continue
+                if label == '|':
+                    memo[node] = any(memo[child] for child in children)
+                else:
+                    memo[node] = all(memo[child] for child in children)
+            stack.pop()
+        return memo[root]
+
+    def _required(self, node):
+        # Потомки, производные которых нужны для производной node
+        label, children = node.label, node.children
+        if label == '.':
+            required = []
+            for child in children:
+                required.append(child)
+                if not self.nullable(child):
+                    break
+            return required
+        return children
+
+    def derivative(self, root, symbol):
+        """Производная выражения root по символу symbol."""
+        memo = self._derivatives
+        stack = [root]
+        while stack:
+            node = stack[-1]
+            if (node, symbol) in memo:
+                stack.pop()
+                continue
+            children = node.children
+            if not children:
+                memo[node, symbol] = self.epsilon if node.label == symbol else self.empty
+                stack.pop()
+                continue
+            required = self._required(node)
+            pending = [child for child in required if (child, symbol) not in memo]
+            if pending:
+                stack.extend(pending)
+                continue
+            stack.pop()
+            label = node.label
+            if label == '|':
+                result = self.union([memo[child, symbol] for child in children])
+            elif label == '*':
+                result = self.concat((memo[children[0], symbol], node))
+            else:
+                result = self.union([self.concat((memo[child, symbol],) + children[index + 1:])
+                                     for index, child in enumerate(required)])
+            memo[node, symbol] = result
+        return memo[root, symbol]
+
+    def fullmatch(self, text):
+        """Соответствует ли вся строка text выражению."""
+        node = self.root
+        for symbol in text:
+            node = self.derivative(node, symbol)
+            if node is self.empty:
+                return False
+        return self.nullable(node)
+
+
+def derivative_fullmatch(regex, text):
+    """Разовая проверка строки производными, без построения автомата."""
+    return DerivativeMatcher.from_regex(regex).fullmatch(text)
+
+
+BATCH_STAGES = ('parse_cache', 'validate', 'parse', 'flatten_associative', 'RewriteEngine', 'SMT2Converter.convert')
+
+
+def iter_regex_lines(stream, input_format='lines'):
+    """Потоково читает регулярные выражения: по одному на строку или в формате JSONL.
+
+    Возвращает пары (номер строки, выражение). В JSONL запись - либо строка,
+    либо объект с полем "regex". Пустые строки пропускаются."""
+    for line_number, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        if input_format == 'jsonl':
+            try:
+                record = json.loads(line)
+            except ValueError:
+                yield line_number, None
+                continue
+            if isinstance(record, dict):
+                record = record.get('regex')
+            yield line_number, record if isinstance(record, str) else None
+        else:
+            yield line_number, line
+
+
+def convert_regex(regex, timings=None, nary=False, simplify=False, rule_stats=False):
+    """Прогоняет одно выражение через разбор → дерево → SMT2.
+
+    Дерево берётся из parse_cache: повторяющиеся в корпусе выражения проверяются
+    и разбираются один раз на процесс. Если передан словарь timings, в него
+    накапливаются время каждого этапа и число прошедших его выражений ('items <этап>').
+    При nary=True цепочки '.' и '|' сворачиваются в n-арные термы, при
+    simplify=True дерево перед выводом упрощается RewriteEngine; rule_stats=True
+    добавляет в timings время каждого правила и число узлов (RewriteEngine.profile)."""
+    if regex is None:
+        raise ValueError("Запись не содержит регулярного выражения.")
+    clock = time.perf_counter
+    started = clock()
+
+    def mark(stage):
+        nonlocal started
+        now = clock()
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + (now - started)
+            timings[f'items {stage}'] = timings.get(f'items {stage}', 0) + 1
+        started = now
+
+    parse_tree = parse_cache.get(regex)
+    mark('parse_cache')
+    if parse_tree is None:
+        try:
+            validate_regex(regex)
+        finally:
+            mark('validate')
+        parse_tree = parse_cache.put(regex, parse_regex(regex))
+        mark('parse')
+    if nary or simplify:
+        parse_tree = flatten_associative(parse_tree)
+        mark('flatten_associative')
+    if simplify:
+        engine = RewriteEngine(profile=rule_stats)
+        parse_tree = engine.rewrite(parse_tree)
+        mark('RewriteEngine')
+        if rule_stats and timings is not None:
+            engine.add_stats(timings)
+    smt2_repr = SMT2Converter(parse_tree).convert()
+    mark('SMT2Converter.convert')
+    return smt2_repr
+
+
+class BatchStats:
+    """Счётчики пакетной обработки и время по этапам конвейера."""
+
+    def __init__(self):
+        self.processed = 0
+        self.failed = 0
+        self.cache_hits = 0
+        # Время этапов; при упрощении также число узлов и время каждого правила
+        self.timings = dict.fromkeys(BATCH_STAGES, 0.0)
+        self.started = time.perf_counter()
+
+    def add_timings(self, timings):
+        for stage, seconds in timings.items():
+            self.timings[stage] = self.timings.get(stage, 0) + seconds
+
+    def report(self, stream=sys.stderr):
+        elapsed = time.perf_counter() - self.started
+        total = self.processed + self.failed
+        print(f"Обработано выражений: {total} (успешно: {self.processed}, с ошибкой: {self.failed})",
+              file=stream)
+        if self.cache_hits:
+            print(f"Взято из дискового кэша: {self.cache_hits}", file=stream)
+        print(f"Общее время: {elapsed:.3f} с, {total / elapsed if elapsed else 0.0:.1f} выражений/с",
+              file=stream)
+        # Скорость этапа - по выражениям, которые через него прошли (без попаданий в кэши)
+        for stage in BATCH_STAGES:
+            seconds = self.timings.get(stage)
+            if not seconds:
+                continue
+            items = self.timings.get(f'items {stage}', total)
+            print(f"  {stage:<28} {seconds:10.3f} с {items / seconds:14.1f} выражений/с "
+                  f"({items} выражений)", file=stream)
+        if 'nodes_before' in self.timings:
+            print(f"Узлов до упрощения: {self.timings['nodes_before']}, "
+                  f"после: {self.timings['nodes_after']}", file=stream)
+            for key, seconds in self.timings.items():
+                if key.startswith('rule '):
+                    name = key[len('rule '):]
+                    print(f"  {name:<28} {seconds:10.3f} с, срабатываний: {self.timings[f'hits {name}']}",
+                          file=stream)
+
+
+def write_result(stream, output_format, line_number, regex, smt2_repr=None, error=None):
+    """Записывает результат для одного выражения в выходной поток."""
+    if output_format == 'jsonl':
+        record = {'line': line_number, 'regex': regex}
+        if error is None:
+            record['smt2'] = smt2_repr
+        else:
+            record['error'] = error
+        stream.write(json.dumps(record, ensure_ascii=False) + '\n')
+    elif error is None:
+        stream.write(smt2_repr + '\n')
+    else:
+        # Комментарий SMT-LIB2 сохраняет соответствие строк входа и выхода
+        stream.write(f"; Ошибка (строка {line_number}): {error}\n")
+
+
+def convert_chunk(chunk, nary=False, simplify=False, rule_stats=False):
+    """Преобразует пачку пар (номер строки, выражение) в рабочем процессе.
+
+    Ошибки фиксируются для каждого выражения отдельно и не прерывают пачку:
+    для ValueError сохраняется сообщение, для прочих исключений - ещё и их тип."""
+    timings = {}
+    results = []
+    for line_number, regex in chunk:
+        try:
+            results.append((line_number, regex, convert_regex(regex, timings, nary, simplify, rule_stats), None))
+        except ValueError as e:
+            results.append((line_number, regex, None, str(e)))
+        except Exception as e:
+            results.append((line_number, regex, None, f"{type(e).__name__}: {e}"))
+    return results, timings
+
+
+def iter_chunks(items, chunk_size):
+    """Разбивает поток на списки длины chunk_size, не читая поток целиком."""
+    iterator = iter(items)
+    while True:
+        chunk = list(itertools.islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def iter_converted_parallel(chunks, workers, convert=convert_chunk):
+    """Распределяет пачки выражений по пулу процессов и отдаёт результаты в порядке входа.
+
+    Одновременно в работе не больше workers * 4 пачек, поэтому память ограничена
+    независимо от размера корпуса."""
+    with multiprocessing.Pool(workers) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.apply_async(convert, (chunk,)))
+            if len(pending) >= workers * 4:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+
+def split_cached(chunk, cache):
+    """Делит пачку на найденные в дисковом кэше результаты и выражения для преобразования."""
+    cached = {}
+    misses = []
+    for line_number, regex in chunk:
+        smt2_repr = cache.get(regex) if regex is not None else None
+        if smt2_repr is None:
+            misses.append((line_number, regex))
+        else:
+            cached[line_number] = smt2_repr
+    return cached, misses
+
+
+def iter_converted_cached(chunks, convert_chunks, cache):
+    """Пропускает через convert_chunks только выражения, которых нет в дисковом кэше.
+
+    Результаты собираются обратно в исходном порядке, новые успешные
+    преобразования сохраняются в кэш."""
+    prepared = ((chunk,) + split_cached(chunk, cache) for chunk in chunks)
+    prepared, for_conversion = itertools.tee(prepared)
+    converted = convert_chunks(misses for _, _, misses in for_conversion)
+    for (chunk, cached, _), (results, timings) in zip(prepared, converted):
+        computed = iter(results)
+        merged = []
+        for line_number, regex in chunk:
+            if line_number in cached:
+                merged.append((line_number, regex, cached[line_number], None))
+            else:
+                merged.append(next(computed))
+        cache.put_many([(regex, smt2_repr) for _, regex, smt2_repr, error in results if error is None])
+        yield merged, timings, len(cached)
+
+
+def run_batch(input_stream, output_stream, input_format='lines', output_format='lines',
+              workers=1, chunk_size=256, cache=None, nary=False, simplify=False, rule_stats=False):
+    """Пакетно преобразует поток регулярных выражений в SMT2, не держа весь корпус в памяти.
+
+    При workers > 1 преобразование выполняется пулом процессов с сохранением порядка.
+    cache - необязательный SMT2DiskCache: найденные в нём выражения не разбираются заново.
+    nary - выводить n-арные термы re.union/re.++ (см. flatten_associative),
+    simplify - упрощать деревья RewriteEngine перед выводом, rule_stats - замерять
+    при этом время каждого правила."""
+    stats = BatchStats()
+    chunks = iter_chunks(iter_regex_lines(input_stream, input_format), chunk_size)
+    convert = functools.partial(convert_chunk, nary=nary, simplify=simplify, rule_stats=rule_stats)
+    if workers > 1:
+        def convert_chunks(chunks):
+            return iter_converted_parallel(chunks, workers, convert)
+    else:
+        def convert_chunks(chunks):
+            return map(convert, chunks)
+    if cache is not None:
+        converted = iter_converted_cached(chunks, convert_chunks, cache)
+    else:
+        converted = ((results, timings, 0) for results, timings in convert_chunks(chunks))
+    for results, timings, cache_hits in converted:
+        stats.add_timings(timings)
+        stats.cache_hits += cache_hits
+        for line_number, regex, smt2_repr, error in results:
+            if error is None:
+                stats.processed += 1
+            else:
+                stats.failed += 1
+            write_result(output_stream, output_format, line_number, regex, smt2_repr, error)
+    return stats
+
+
+def make_deep_tree(depth, make_node=TreeNode):
+    """Левоассоциативная цепочка конкатенаций глубины depth - дерево для 'aa...a'."""
+    return build_parse_tree_from_rpn(['a'] + ['a', '.'] * (depth - 1), make_node)
+
+
+def best_time(func, repeat=3):
+    """Минимальное время выполнения func за repeat запусков, в секундах."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _recursive_display_tree(node, depth=0):
+    # Прежняя рекурсивная версия display_tree - эталон для сравнения
+    print("  " * depth + node.label)
+    if node.left:
+        _recursive_display_tree(node.left, depth + 1)
+    if node.right:
+        _recursive_display_tree(node.right, depth + 1)
+
+
+def _recursive_add_nodes_edges(node, graph, node_id=0, parent_id=None):
+    # Прежняя рекурсивная версия add_nodes_edges - эталон для сравнения
+    if node is not None:
+        current_id = node_id
+        node_id += 1
+        add_graph_node(graph, current_id, node.label, parent_id)
+        if node.left:
+            node_id = _recursive_add_nodes_edges(node.left, graph, node_id, current_id)
+        if node.right:
+            node_id = _recursive_add_nodes_edges(node.right, graph, node_id, current_id)
+    return node_id
+
+
+def _recursive_smt2(node):
+    # Прежняя рекурсивная версия SMT2Converter._convert_node со склейкой строк - эталон
+    if node.label == '|':
+        return f"(re.union {_recursive_smt2(node.left)} {_recursive_smt2(node.right)})"
+    elif node.label == '.':
+        left = _recursive_smt2(node.left)
+        right = _recursive_smt2(node.right)
+        prefix = '(str.to_re "'
+        if left.startswith(prefix) and right.startswith(prefix):
+            return f'(str.to_re "{left[len(prefix):-2] + right[len(prefix):-2]}")'
+        return f"(re.++ {left} {right})"
+    elif node.label == '*':
+        return f"(re.* {_recursive_smt2(node.left)})"
+    return f'(str.to_re "{"" if node.label == EPSILON else node.label}")'
+
+
+def benchmark_walkers(depths=(10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6), repeat=3, stream=sys.stdout):
+    """Сравнивает итеративные обходчики дерева с рекурсивными на глубоких деревьях.
+
+    Вывод дерева растёт квадратично с глубиной (отступы), поэтому display_tree
+    и verify_associativity замеряются только до глубины 10^4, граф Graphviz - до 10^5.
+    Рекурсивные версии запускаются до глубины 10^5 с поднятым лимитом рекурсии."""
+    walkers = [
+        ('display_tree', 10 ** 4,
+         lambda tree: display_tree(tree), lambda tree: _recursive_display_tree(tree)),
+        ('add_nodes_edges', 10 ** 5,
+         lambda tree: add_nodes_edges(tree, Digraph()), lambda tree: _recursive_add_nodes_edges(tree, Digraph())),
+        ('SMT2Converter.convert', 10 ** 6,
+         lambda tree: SMT2Converter(tree).convert(), _recursive_smt2),
+        ('verify_associativity', 10 ** 4, verify_associativity, None),
+    ]
+    results = []
+    recursion_limit = sys.getrecursionlimit()
+    print(f"{'обход':<24}{'глубина':>10}{'итеративно, с':>16}{'рекурсивно, с':>16}", file=stream)
+    for depth in depths:
+        tree = make_deep_tree(depth)
+        for name, max_depth, iterative, recursive in walkers:
+            if depth > max_depth:
+                continue
+            with open(os.devnull, 'w', encoding='utf-8') as sink, contextlib.redirect_stdout(sink):
+                iterative_time = best_time(lambda: iterative(tree), repeat)
+                recursive_time = None
+                if recursive is not None and depth <= 10 ** 5:
+                    sys.setrecursionlimit(max(recursion_limit, depth + 1000))
+                    try:
+                        recursive_time = best_time(lambda: recursive(tree), repeat)
+                    finally:
+                        sys.setrecursionlimit(recursion_limit)
+            results.append({'walker': name, 'depth': depth,
+                            'iterative': iterative_time, 'recursive': recursive_time})
+            recursive_text = f"{recursive_time:16.4f}" if recursive_time is not None else f"{'-':>16}"
+            print(f"{name:<24}{depth:>10}{iterative_time:16.4f}{recursive_text}", file=stream)
+    return results
+
+
+def make_benchmark_regex(size, seed=0):
+    """Детерминированное корректное выражение длиной около size символов."""
+    rng = random.Random(seed)
+    pieces = ['ab', 'c', '(a|b)*', 'c*', '(abc|d)', '(a(b|c)*|d)', 'e|f']
+    parts = []
+    length = 0
+    while length < size:
+        piece = rng.choice(pieces)
+        parts.append(piece)
+        length += len(piece)
+    return ''.join(parts)
+
+
+def benchmark_parser(sizes=(10 ** 4, 10 ** 5, 10 ** 6), repeat=3, stream=sys.stdout):
+    """Пропускная способность разбора (МБ/с текста выражения): многопроходный
+    конвейер tokenize → to_rpn → build_parse_tree_from_rpn против parse_regex."""
+    parsers = [
+        ('tokenize+to_rpn+build', lambda regex: build_parse_tree_from_rpn(to_rpn(tokenize(regex)))),
+        ('parse_regex', parse_regex),
+        ('parse_regex_flat', parse_regex_flat),
+    ]
+    results = []
+    print(f"{'разбор':<24}{'размер':>10}{'время, с':>12}{'МБ/с':>10}", file=stream)
+    for size in sizes:
+        regex = make_benchmark_regex(size)
+        megabytes = len(regex.encode('utf-8')) / 1e6
+        for name, parse in parsers:
+            seconds = best_time(lambda: parse(regex), repeat)
+            results.append({'parser': name, 'size': len(regex), 'seconds': seconds,
+                            'mb_per_s': megabytes / seconds})
+            print(f"{name:<24}{len(regex):>10}{seconds:12.4f}{megabytes / seconds:10.2f}", file=stream)
+    return results
+
+
+def benchmark_smt2(sizes=(10 ** 3, 10 ** 4, 10 ** 5), repeat=3, corpus_size=20000, stream=sys.stdout):
+    """Время SMT2Converter.convert в сравнении с прежней рекурсивной склейкой строк.
+
+    Длинные конкатенации литералов ('aa...a'), цепочки со смешанными узлами
+    ('ab*ab*...') и выражения make_benchmark_regex замеряются по одному дереву,
+    типичный корпус - corpus_size коротких выражений RegexGenerator, как в
+    пакетном режиме (время на весь корпус)."""
+    inputs = [
+        ('литералы', lambda size: [make_deep_tree(size)]),
+        ('смешанные', lambda size: [parse_regex('ab*' * (size // 3))]),
+        ('выражение', lambda size: [parse_regex(make_benchmark_regex(size))]),
+    ]
+    generator = RegexGenerator(seed=0)
+    cases = [(name, size, make_trees) for size in sizes for name, make_trees in inputs]
+    cases.append(('корпус', corpus_size, lambda size: [generator.tree() for _ in range(size)]))
+    results = []
+    recursion_limit = sys.getrecursionlimit()
+    print(f"{'деревья':<12}{'размер':>10}{'линейно, с':>14}{'склейка, с':>14}", file=stream)
+    for name, size, make_trees in cases:
+        trees = make_trees(size)
+        linear_time = best_time(lambda: [SMT2Converter(tree).convert() for tree in trees], repeat)
+        sys.setrecursionlimit(max(recursion_limit, size + 1000))
+        try:
+            concat_time = best_time(lambda: [_recursive_smt2(tree) for tree in trees], repeat)
+        finally:
+            sys.setrecursionlimit(recursion_limit)
+        results.append({'tree': name, 'size': size, 'linear': linear_time, 'concatenation': concat_time})
+        print(f"{name:<12}{size:>10}{linear_time:14.4f}{concat_time:14.4f}", file=stream)
+    return results
+
+
+BENCHMARKS = {
+    'walkers': benchmark_walkers,
+    'parser': benchmark_parser,
+    'smt2': benchmark_smt2,
+}
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Разбор регулярных выражений и преобразование в SMT2.")
+    parser.add_argument('input', nargs='?', default='-',
+                        help="файл с выражениями ('-' - стандартный ввод)")
+    parser.add_argument('-o', '--output', default='-', help="файл для результатов ('-' - стандартный вывод)")
+    parser.add_argument('--input-format', choices=('lines', 'jsonl'), default='lines')
+    parser.add_argument('--output-format', choices=('lines', 'jsonl'), default='lines')
+    parser.add_argument('-j', '--workers', type=int, default=1,
+                        help="число рабочих процессов (0 - по числу ядер)")
+    parser.add_argument('--chunk-size', type=int, default=256, help="размер пачки для рабочего процесса")
+    parser.add_argument('--cache', metavar='PATH',
+                        help="файл SQLite с дисковым кэшем SMT2 представлений")
+    parser.add_argument('--nary', action='store_true',
+                        help="сворачивать цепочки '.' и '|' в n-арные термы re.++ и re.union")
+    parser.add_argument('--simplify', action='store_true',
+                        help="упрощать деревья по правилам RewriteEngine (вывод n-арный)")
+    parser.add_argument('--rule-stats', action='store_true',
+                        help="с --simplify замерять время каждого правила (медленнее)")
+    parser.add_argument('--benchmark', choices=sorted(BENCHMARKS),
+                        help="запустить замер производительности вместо преобразования")
+    return parser.parse_args(argv)
+
+
+def batch_main(argv):
+    """Неинтерактивный режим: поток выражений из файла или stdin, результаты - в поток."""
+    args = parse_args(argv)
+    if args.benchmark:
+        BENCHMARKS[args.benchmark]()
+        return
+    input_stream = sys.stdin if args.input == '-' else open(args.input, encoding='utf-8')
+    output_stream = sys.stdout if args.output == '-' else open(args.output, 'w', encoding='utf-8')
+    cache = None
+    if args.cache:
+        cache = SMT2DiskCache(args.cache, smt2_format_version(args.nary, args.simplify))
+    try:
+        workers = args.workers or os.cpu_count() or 1
+        stats = run_batch(input_stream, output_stream, args.input_format, args.output_format,
+                          workers, args.chunk_size, cache, args.nary, args.simplify, args.rule_stats)
+    finally:
+        if cache is not None:
+            cache.close()
+        if input_stream is not sys.stdin:
+            input_stream.close()
+        if output_stream is not sys.stdout:
+            output_stream.close()
+    stats.report()
 
 
 def main():
@@ -262,10 +3084,7 @@ def main():
             continue
 
         try:
-            validate_empty_groups(regex)
-            tokens = tokenize(regex)
-            rpn = to_rpn(tokens)
-            parse_tree = build_parse_tree_from_rpn(rpn)
+            parse_tree = parse_cache.parse(regex)
             print("Дерево разбора регулярного выражения:")
             display_tree(parse_tree)
             verify_associativity(parse_tree)
@@ -279,4 +3098,7 @@ def main():
             print(f"Ошибка: {e}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    if len(sys.argv) > 1:
+        batch_main(sys.argv[1:])
+    else:
+        main()
\ No newline at end of file
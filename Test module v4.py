@@ -1,6 +1,34 @@
 import re
 import random
-from z3 import Solver, Bool, Or, And, Not, sat
+import os
+import sys
+import functools
+import shutil
+import tempfile
+import importlib.util
+import time
+import json
+import argparse
+import multiprocessing
+from z3 import (Solver, InRe, Re, StringVal, Union, Star, Concat, Plus, Option, Loop, Range, sat,
+                parse_smt2_string)
+
+
+def load_script(name, filename):
+    """Загружает соседний скрипт как модуль (в именах файлов пробелы, обычный import не подходит)."""
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), filename)
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    # Регистрация в sys.modules нужна, чтобы объекты модуля передавались между процессами
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+rewrite = load_script('regular_tree_rewrite', 'Regular tree rewrite v3.py')
 
 # Обновленная база регулярных выражений
 base_regex = [
@@ -8,8 +36,44 @@ base_regex = [
     "(a|ba|bc*)", "(ab|c)*", "[a-z]", "[0-9]", "a{2,3}", "b+", "\d", "\w", "\s", "\."
 ]
 
+@functools.lru_cache(maxsize=4096)
+def string_sampler(regex):
+    """Генератор строк по дереву разбора; использует общий модуль random, так что
+    random.seed() по-прежнему задаёт воспроизводимую последовательность."""
+    return rewrite.StringSampler.from_regex(regex, rng=random)
+
+# Наибольшая длина строк, которые generate_matching_string выбирает равновероятно
+MATCHING_STRING_MAX_LENGTH = 8
+# Для более длинных выражений DFA может разрастись, и строка строится обходом дерева
+MATCHING_STRING_COUNTER_MAX_REGEX = 200
+
+@functools.lru_cache(maxsize=4096)
+def match_counter(regex):
+    return rewrite.MatchCounter.from_regex(regex)
+
 def generate_matching_string(regex):
-    """Генерирует строку, соответствующую заданному регулярному выражению."""
+    """Генерирует строку, соответствующую заданному регулярному выражению.
+
+    Для выражений, которые разбираются в дерево, длина выбирается равновероятно
+    среди возможных длин до MATCHING_STRING_MAX_LENGTH, а строка - равновероятно
+    среди всех соответствующих строк этой длины; если таких коротких строк нет
+    или выражение длиннее MATCHING_STRING_COUNTER_MAX_REGEX, строка строится
+    обходом дерева. Для остальных выражений (классы символов,
+    повторы, экранирование) остаётся разбор известных выражений."""
+    try:
+        check_supported_syntax(regex)
+        if len(regex) > MATCHING_STRING_COUNTER_MAX_REGEX:
+            return string_sampler(regex).sample()
+        counter = match_counter(regex)
+    except ValueError:
+        return generate_matching_string_by_text(regex)
+    try:
+        return counter.sample_up_to(MATCHING_STRING_MAX_LENGTH, random, by_length=True)
+    except ValueError:
+        return string_sampler(regex).sample()
+
+def generate_matching_string_by_text(regex):
+    """Строка для известных выражений базы, которые не разбираются в дерево."""
     if regex == 'a':
         return 'a'
     elif regex == 'b':
@@ -55,84 +119,225 @@ def generate_matching_string(regex):
     else:
         return ''.join(random.choice(['a', 'b', 'c']) for _ in range(random.randint(1, 5)))
 
+# Символы, которые понимает разбор в дерево: операнды (буквы, цифры, ε) и операторы
+Z3_OPERATORS = set('()|*')
+
+def check_supported_syntax(regex):
+    """Дерево разбора строится только из букв, ε и ()|*; классы символов, повторы
+    {m,n}, '+', '?', '.' и экранирование переводит в Z3 translate_extended_regex."""
+    for char in regex:
+        if not (char.isalnum() or char == rewrite.EPSILON or char in Z3_OPERATORS):
+            raise ValueError(f"Конструкция '{char}' в выражении '{regex}' не поддерживается проверкой Z3.")
+
+@functools.lru_cache(maxsize=4096)
 def regex_to_z3_expr(regex):
-    """Преобразует регулярное выражение в выражение Z3."""
-    if regex == '.*':
-        return True  # Совпадает с любой строкой
-    if regex == '.':
-        return Or(*[Bool(chr(i)) for i in range(97, 123)])  # Для любых символов a-z
-    if regex == 'a':
-        return Bool('a')
-    if regex == 'b':
-        return Bool('b')
-    if regex == 'c':
-        return Bool('c')
-    if regex == 'a*':
-        return Or(Bool('a'), Bool(''))
-    if regex == 'b*':
-        return Or(Bool('b'), Bool(''))
-    if regex == 'c*':
-        return Or(Bool('c'), Bool(''))
-    if regex == 'a|b':
-        return Or(Bool('a'), Bool('b'))
-    if regex == '(a|b)':
-        return Or(Bool('a'), Bool('b'))
-    if regex == 'ab':
-        return And(Bool('a'), Bool('b'))
-    if regex == 'abc':
-        return And(Bool('a'), Bool('b'), Bool('c'))
-    if regex == '[a-z]':
-        return Or(*[Bool(chr(i)) for i in range(97, 123)])  # Диапазон a-z
-    if regex == '[0-9]':
-        return Or(*[Bool(str(i)) for i in range(10)])  # Диапазон 0-9
-    if regex == 'a{2,3}':
-        return Or(And(Bool('a'), Bool('a')), And(Bool('a'), Bool('a'), Bool('a')))
-    if regex == 'b+':
-        return Or(Bool('b'), And(Bool('b'), Bool('b')))
-    if regex == '\d':
-        return Or(*[Bool(str(i)) for i in range(10)])  # Обработка цифровых символов
-    if regex == '\w':
-        return Or(*[Bool(chr(i)) for i in range(97, 123)] + [Bool(str(i)) for i in range(10)])  # A-Z или 0-9
-    if regex == '\s':
-        return Bool(' ')  # Пробел
-    if regex == '\.':
-        return Bool('.')
-
-    # Добавляем обработку для других операторов
-    if '|' in regex:
-        parts = regex.split('|')
-        return Or(*[regex_to_z3_expr(part) for part in parts])
-    if '*' in regex:
-        base = regex.split('*')[0]
-        return Or(regex_to_z3_expr(base), Bool(''))
-    if '?' in regex:
-        base = regex.split('?')[0]
-        return Or(regex_to_z3_expr(base))
-
-    return Bool(regex)
+    """Строит терм Z3 (Re, Union, Star, Concat) по дереву разбора выражения.
+
+    Терм запоминается, повторные проверки того же выражения его не пересобирают.
+    Выражения вне синтаксиса дерева разбора переводит translate_extended_regex."""
+    try:
+        check_supported_syntax(regex)
+    except ValueError:
+        return translate_extended_regex(regex)
+    tree = rewrite.flatten_associative(rewrite.parse_cache.parse(regex))
+    results = []
+    stack = [(tree, False)]
+    while stack:
+        node, expanded = stack.pop()
+        if not node.children:
+            results.append('' if node.label == rewrite.EPSILON else node.label)
+            continue
+        if not expanded:
+            stack.append((node, True))
+            stack.extend((child, False) for child in reversed(node.children))
+            continue
+        parts = results[-len(node.children):]
+        del results[-len(node.children):]
+        # Соседние литералы цепочки склеиваются в одну строку
+        terms = []
+        for part in parts:
+            if node.label == '.' and terms and isinstance(part, str) and isinstance(terms[-1], str):
+                terms[-1] += part
+            else:
+                terms.append(part)
+        terms = [Re(StringVal(term)) if isinstance(term, str) else term for term in terms]
+        if node.label == '*':
+            results.append(Star(terms[0]))
+        elif len(terms) == 1:
+            results.append(terms[0])
+        elif node.label == '|':
+            results.append(Union(*terms))
+        else:
+            results.append(Concat(*terms))
+    result = results.pop()
+    if isinstance(result, str):
+        result = Re(StringVal(result))
+    return result
+
+# Классы escape-последовательностей в пределах ASCII - как и строки, которые строит
+# generate_matching_string_by_text; \s - это [ \t\n\v\f\r]
+Z3_ESCAPE_RANGES = {
+    'd': [('0', '9')],
+    'w': [('a', 'z'), ('A', 'Z'), ('0', '9'), ('_', '_')],
+    's': [(' ', ' '), ('\t', '\r')],
+}
+# '.' - любой символ, кроме перевода строки (до наибольшего символа Z3)
+Z3_ANY_RANGES = [('\x00', '\t'), ('\x0b', '\U0002ffff')]
+Z3_BOUNDS = re.compile(r'\{(\d*)(,(\d*))?\}')
+
+def translate_extended_regex(regex):
+    """Переводит выражение синтаксиса re в терм Z3 рекурсивным спуском: классы
+    символов [..] с диапазонами, \d \w \s и экранированные символы, '.', '+',
+    '?', {m}, {m,}, {,n}, {m,n} и группы (?:..) - через Range, Plus, Option, Loop, Union.
+
+    Отрицания ([^..], \D, \W, \S), якоря и обратные ссылки не поддерживаются (ValueError)."""
+    term, position = z3_union(regex, 0)
+    if position != len(regex):
+        raise ValueError(f"Лишняя ')' в позиции {position} выражения '{regex}'.")
+    return term
+
+def z3_ranges(ranges):
+    terms = [Range(low, high) if low != high else Re(StringVal(low)) for low, high in ranges]
+    return terms[0] if len(terms) == 1 else Union(*terms)
+
+def z3_loop(term, low, high):
+    """Повтор term от low до high раз (high=None - без верхней границы). В Z3 Loop
+    с верхней границей 0 означает «без границы», поэтому {0} и {m,} строятся иначе."""
+    if high is None:
+        return Star(term) if low == 0 else Concat(Loop(term, low, low), Star(term))
+    if high == 0:
+        return Re(StringVal(''))
+    return Loop(term, low, high)
+
+def z3_union(regex, position):
+    branches = []
+    while True:
+        term, position = z3_concat(regex, position)
+        branches.append(term)
+        if position == len(regex) or regex[position] != '|':
+            break
+        position += 1
+    return (branches[0] if len(branches) == 1 else Union(*branches)), position
+
+def z3_concat(regex, position):
+    items = []
+    while position < len(regex) and regex[position] not in '|)':
+        term, position = z3_atom(regex, position)
+        quantified = False
+        while position < len(regex):
+            char = regex[position]
+            bounds = Z3_BOUNDS.match(regex, position) if char == '{' else None
+            if bounds and not bounds.group(1) and bounds.group(2) is None:
+                bounds = None  # '{}' - это литералы, как в re
+            if quantified and char in '?+':
+                # Ленивый повтор допускает тот же язык, захватывающий - нет
+                if char == '+':
+                    raise ValueError(f"Захватывающий повтор в выражении '{regex}' не поддерживается проверкой Z3.")
+                quantified = False
+                position += 1
+                continue
+            quantified = True
+            if char == '*':
+                term = Star(term)
+            elif char == '+':
+                term = Plus(term)
+            elif char == '?':
+                term = Option(term)
+            elif bounds:
+                low = int(bounds.group(1) or 0)
+                high = low if bounds.group(2) is None else int(bounds.group(3)) if bounds.group(3) else None
+                term = z3_loop(term, low, high)
+                position = bounds.end()
+                continue
+            else:
+                break
+            position += 1
+        items.append(term)
+    if not items:
+        return Re(StringVal('')), position
+    return (items[0] if len(items) == 1 else Concat(*items)), position
+
+def z3_escape(regex, position):
+    """Диапазоны для escape-последовательности, начинающейся с '\\' в позиции position."""
+    if position + 1 >= len(regex):
+        raise ValueError(f"Выражение '{regex}' оканчивается на '\\'.")
+    char = regex[position + 1]
+    if char in Z3_ESCAPE_RANGES:
+        return Z3_ESCAPE_RANGES[char], position + 2
+    if char.isalnum():
+        raise ValueError(f"Конструкция '\\{char}' в выражении '{regex}' не поддерживается проверкой Z3.")
+    return [(char, char)], position + 2
+
+def z3_atom(regex, position):
+    char = regex[position]
+    if char == '(':
+        if regex.startswith('?:', position + 1):
+            position += 2
+        elif regex.startswith('?', position + 1):
+            raise ValueError(f"Конструкция '(?' в выражении '{regex}' не поддерживается проверкой Z3.")
+        term, position = z3_union(regex, position + 1)
+        if position == len(regex):
+            raise ValueError(f"Незакрытая '(' в выражении '{regex}'.")
+        return term, position + 1
+    if char == '[':
+        return z3_class(regex, position + 1)
+    if char == '\\':
+        ranges, position = z3_escape(regex, position)
+        return z3_ranges(ranges), position
+    if char == '.':
+        return z3_ranges(Z3_ANY_RANGES), position + 1
+    if char in '^$*+?':
+        raise ValueError(f"Конструкция '{char}' в выражении '{regex}' не поддерживается проверкой Z3.")
+    return Re(StringVal(char)), position + 1
+
+def z3_class(regex, position):
+    """Класс символов [..], начинающийся после '[' в позиции position."""
+    if regex.startswith('^', position):
+        raise ValueError(f"Отрицание класса в выражении '{regex}' не поддерживается проверкой Z3.")
+    ranges = []
+    first = True
+    while position < len(regex) and (regex[position] != ']' or first):
+        first = False
+        if regex[position] == '\\':
+            items, position = z3_escape(regex, position)
+            ranges += items
+            continue
+        low = regex[position]
+        position += 1
+        if regex.startswith('-', position) and position + 1 < len(regex) and regex[position + 1] != ']':
+            high = regex[position + 1]
+            if high == '\\':
+                raise ValueError(f"Экранированная граница диапазона в выражении '{regex}' не поддерживается проверкой Z3.")
+            ranges.append((low, high))
+            position += 2
+        else:
+            ranges.append((low, low))
+    if position == len(regex):
+        raise ValueError(f"Незакрытая '[' в выражении '{regex}'.")
+    return z3_ranges(ranges), position + 1
+
+_solver = None
+
+def get_solver():
+    """Общий решатель для всех проверок: запросы изолируются через push/pop."""
+    global _solver
+    if _solver is None:
+        _solver = Solver()
+    return _solver
 
 def z3_check(regex, test_string):
-    """Проверка строки с помощью Z3."""
-    solver = Solver()
-    z3_expr = regex_to_z3_expr(regex)
-
-    # Переменные для каждой позиции в строке
-    string_vars = [Bool(f'char_{i}') for i in range(len(test_string))]
-
-    # Проверка по символам
-    for i, char in enumerate(test_string):
-        if char == 'a':
-            z3_expr = And(z3_expr, Bool('a'))
-        elif char == 'b':
-            z3_expr = And(z3_expr, Bool('b'))
-        elif char == 'c':
-            z3_expr = And(z3_expr, Bool('c'))
-        elif char.isdigit():
-            z3_expr = And(z3_expr, Bool(char))
-
-    # Добавляем выражение для решения
-    solver.add(z3_expr)
-    result = solver.check()
+    """Проверка строки с помощью Z3 (теория строк: str.in_re)."""
+    return z3_accepts(regex_to_z3_expr(regex), test_string)
+
+def z3_accepts(z3_expr, test_string):
+    """Принадлежит ли строка языку терма Z3."""
+    solver = get_solver()
+    solver.push()
+    try:
+        solver.add(InRe(StringVal(test_string), z3_expr))
+        result = solver.check()
+    finally:
+        solver.pop()
     return result == sat
 
 def python_check(regex, test_string):
@@ -144,6 +349,285 @@ def generate_random_regex(base_expressions):
     """Генерирует случайное регулярное выражение на основе базы правильных выражений."""
     return random.choice(base_expressions)
 
+compiled_nfa = functools.lru_cache(maxsize=4096)(rewrite.compile_regex_nfa)
+compiled_derivative_matcher = functools.lru_cache(maxsize=4096)(rewrite.DerivativeMatcher.from_regex)
+
+def nfa_check(regex, test_string):
+    """Проверка автоматом Томпсона."""
+    return compiled_nfa(regex).fullmatch(test_string)
+
+def dfa_check(regex, test_string):
+    """Проверка минимальным DFA с плотной таблицей переходов."""
+    return rewrite.compile_dense_dfa(regex).fullmatch(test_string)
+
+def derivative_check(regex, test_string):
+    """Проверка производными Бжозовского по дереву разбора."""
+    return compiled_derivative_matcher(regex).fullmatch(test_string)
+
+@functools.lru_cache(maxsize=4096)
+def rewritten_nfa(regex):
+    """Автомат Томпсона по дереву, упрощённому RewriteEngine."""
+    tree = rewrite.flatten_associative(rewrite.parse_cache.parse(regex))
+    return rewrite.compile_nfa(rewrite.RewriteEngine().rewrite(tree))
+
+def rewrite_check(regex, test_string):
+    """Проверка по упрощённому дереву: упрощение не должно менять язык выражения."""
+    return rewritten_nfa(regex).fullmatch(test_string)
+
+# Автоматы движка mmap_dfa, загруженные из файлов во временном каталоге;
+# освобождаются release_reloaded_dfas в конце каждой порции работы
+_reloaded_dfas = {}
+_dfa_directory = None
+
+def reloaded_dense_dfa(regex):
+    """Минимальный DFA, сохранённый во временный файл и отображённый обратно через mmap."""
+    global _dfa_directory
+    dfa = _reloaded_dfas.get(regex)
+    if dfa is None:
+        if _dfa_directory is None:
+            _dfa_directory = tempfile.mkdtemp(prefix='fuzz-dfa-')
+        path = os.path.join(_dfa_directory, f'{len(_reloaded_dfas)}.dfa')
+        rewrite.compile_dense_dfa(regex).save(path)
+        dfa = _reloaded_dfas[regex] = rewrite.DenseDFA.load(path)
+    return dfa
+
+def release_reloaded_dfas():
+    """Закрывает отображения загруженных автоматов и удаляет их файлы."""
+    global _dfa_directory
+    for dfa in _reloaded_dfas.values():
+        dfa.close()
+    _reloaded_dfas.clear()
+    if _dfa_directory is not None:
+        shutil.rmtree(_dfa_directory, ignore_errors=True)
+        _dfa_directory = None
+
+def mmap_dfa_check(regex, test_string):
+    """Проверка DFA, загруженным из файла: должна совпадать с DFA в памяти."""
+    return reloaded_dense_dfa(regex).fullmatch(test_string)
+
+# Шаблоны, которые движок multi_pattern компилирует в общий автомат вместе с выражением
+MULTI_PATTERN_COMPANIONS = ('a*', '(a|b)*b', 'ε', 'c(a|c)*')
+
+@functools.lru_cache(maxsize=1024)
+def multi_pattern_matcher(regex):
+    return rewrite.MultiPatternMatcher((regex,) + MULTI_PATTERN_COMPANIONS)
+
+def multi_pattern_check(regex, test_string):
+    """Проверка общим автоматом MultiPatternMatcher, где выражение - шаблон 0.
+
+    Теги соседних шаблонов сверяются с проверкой каждого шаблона отдельно;
+    несовпадение записывается как результат движка и считается расхождением."""
+    tags = multi_pattern_matcher(regex).match(test_string)
+    for tag, pattern in enumerate(MULTI_PATTERN_COMPANIONS, 1):
+        if (tag in tags) != nfa_check(pattern, test_string):
+            raise AssertionError(f"Тег шаблона '{pattern}' не совпадает с отдельной проверкой.")
+    return 0 in tags
+
+@functools.lru_cache(maxsize=4096)
+def smt2_z3_expr(regex, nary):
+    """Терм Z3, прочитанный из SMT2 вывода convert_regex (двоичного или n-арного)."""
+    smt2 = rewrite.convert_regex(regex, nary=nary)
+    assertion, = parse_smt2_string(f'(declare-const s String) (assert (str.in_re s {smt2}))')
+    return assertion.arg(1)
+
+def smt2_check(regex, test_string):
+    """Проверка Z3 по двоичному SMT2 выводу SMT2Converter."""
+    return z3_accepts(smt2_z3_expr(regex, False), test_string)
+
+def smt2_nary_check(regex, test_string):
+    """Проверка Z3 по n-арному SMT2 выводу: должна совпадать с двоичным."""
+    return z3_accepts(smt2_z3_expr(regex, True), test_string)
+
+# Движки для дифференциального тестирования: имя -> функция (regex, строка) -> bool
+ENGINES = {
+    're': python_check,
+    'nfa': nfa_check,
+    'lazy_dfa': rewrite.fullmatch,
+    'dfa': dfa_check,
+    'derivative': derivative_check,
+    'z3': z3_check,
+    'rewrite': rewrite_check,
+    'mmap_dfa': mmap_dfa_check,
+    'multi_pattern': multi_pattern_check,
+    'smt2': smt2_check,
+    'smt2_nary': smt2_nary_check,
+}
+
+def generate_fuzz_string(rng, regex, max_length=8, sampler=None, index=0):
+    """Строка для проверки: поочерёдно случайная строка из символов выражения и
+    одного постороннего символа, заведомо соответствующая строка и близкая к ней
+    несоответствующая (если передан генератор sampler)."""
+    kind = index % 3 if sampler is not None else 0
+    if kind:
+        # Из нескольких примеров берётся самый короткий: на длинных строках с
+        # вложенными звёздочками re откатывается экспоненциально долго
+        text = min(sampler.samples(3), key=len)
+        return text if kind == 1 else sampler.near_miss(text)
+    alphabet = sorted({char for char in regex if char.isalnum()}) + ['x']
+    return ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, max_length)))
+
+def run_engines(regex, test_string, engines):
+    """Результаты всех движков; исключение движка записывается как его результат."""
+    results = {}
+    for name in engines:
+        try:
+            results[name] = ENGINES[name](regex, test_string)
+        except Exception as e:
+            results[name] = f"{type(e).__name__}: {e}"
+    return results
+
+def disagree(regex, test_string, engines):
+    return len(set(map(repr, run_engines(regex, test_string, engines).values()))) > 1
+
+def replace_subtree(tree, path, replacement):
+    """Копия n-арного дерева, в которой узел по пути path (номера потомков) заменён."""
+    nodes = [tree]
+    for index in path:
+        nodes.append(nodes[-1].children[index])
+    node = replacement
+    for parent, index in zip(reversed(nodes[:-1]), reversed(path)):
+        children = parent.children[:index] + ((node,) if node is not None else ()) + parent.children[index + 1:]
+        if len(children) == 1 and parent.label in ('.', '|'):
+            node = children[0]
+        else:
+            node = rewrite.NaryNode(parent.label, children)
+    return node
+
+def shrink_candidates(regex):
+    """Выражения меньше исходного: узел заменяется потомком, лишняя ветвь удаляется."""
+    tree = rewrite.flatten_associative(rewrite.parse_validated(regex))
+    stack = [(tree, ())]
+    while stack:
+        node, path = stack.pop()
+        for index, child in enumerate(node.children):
+            yield replace_subtree(tree, path, child)
+            if len(node.children) > 1:
+                yield replace_subtree(tree, path + (index,), None)
+            stack.append((child, path + (index,)))
+
+def minimize_case(regex, test_string, engines):
+    """Уменьшает выражение и строку, пока движки продолжают расходиться."""
+    improved = True
+    while improved:
+        improved = False
+        for candidate in shrink_candidates(regex):
+            candidate_regex = rewrite.tree_to_regex(candidate)
+            if len(candidate_regex) < len(regex) and disagree(candidate_regex, test_string, engines):
+                regex = candidate_regex
+                improved = True
+                break
+        index = 0
+        while index < len(test_string):
+            candidate_string = test_string[:index] + test_string[index + 1:]
+            if disagree(regex, candidate_string, engines):
+                test_string = candidate_string
+                improved = True
+            else:
+                index += 1
+    return regex, test_string
+
+def fuzz_batch(task):
+    """Одна порция работы процесса: (seed, число выражений, строк на выражение,
+    движки, глубина, размер дерева, длина строки, алфавит) -> (число случаев,
+    найденные расхождения)."""
+    seed, regex_count, strings_per_regex, engines, max_depth, max_size, max_length, alphabet = task
+    rng = random.Random(seed)
+    generator = rewrite.RegexGenerator(alphabet, max_depth, max_size, seed=seed)
+    cases = 0
+    disagreements = []
+    for _ in range(regex_count):
+        tree = generator.tree()
+        regex = rewrite.tree_to_regex(tree)
+        sampler = rewrite.StringSampler(tree, rng=rng)
+        for index in range(strings_per_regex):
+            test_string = generate_fuzz_string(rng, regex, max_length, sampler, index)
+            results = run_engines(regex, test_string, engines)
+            cases += 1
+            if len(set(map(repr, results.values()))) > 1:
+                small_regex, small_string = minimize_case(regex, test_string, engines)
+                disagreements.append({
+                    'regex': small_regex,
+                    'string': small_string,
+                    'results': {name: str(value) for name, value in run_engines(small_regex, small_string, engines).items()},
+                    'original_regex': regex,
+                    'original_string': test_string,
+                    'seed': seed,
+                })
+    release_reloaded_dfas()
+    return cases, disagreements
+
+def run_fuzz(cases, workers=1, seed=0, regexes_per_task=50, strings_per_regex=20, engines=tuple(ENGINES),
+             max_depth=4, max_size=15, max_length=8, alphabet='abc', output=None, stream=sys.stdout,
+             report_every=5.0):
+    """Дифференциальное тестирование движков на пуле процессов.
+
+    Расхождения (уже уменьшенные) пишутся строками JSON в output, ход работы и
+    итоговая скорость - в stream. Возвращает (число случаев, список расхождений)."""
+    per_task = regexes_per_task * strings_per_regex
+    tasks = [(seed + index, regexes_per_task, strings_per_regex, tuple(engines), max_depth, max_size, max_length,
+              alphabet)
+             for index in range((cases + per_task - 1) // per_task)]
+    done = 0
+    found = []
+    started = last_report = time.perf_counter()
+    pool = multiprocessing.Pool(workers) if workers > 1 else None
+    try:
+        results = pool.imap_unordered(fuzz_batch, tasks) if pool else map(fuzz_batch, tasks)
+        for batch_cases, disagreements in results:
+            done += batch_cases
+            for case in disagreements:
+                found.append(case)
+                if output is not None:
+                    output.write(json.dumps(case, ensure_ascii=False) + '\n')
+                    output.flush()
+                print(f"Расхождение: '{case['regex']}' на строке '{case['string']}': {case['results']}", file=stream)
+            now = time.perf_counter()
+            if now - last_report >= report_every:
+                last_report = now
+                print(f"Проверено {done} случаев, {done / (now - started):.0f} случаев/с, "
+                      f"расхождений: {len(found)}", file=stream)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    elapsed = time.perf_counter() - started
+    print(f"Итого: {done} случаев за {elapsed:.1f} с ({done / max(elapsed, 1e-9):.0f} случаев/с), "
+          f"движки: {', '.join(engines)}, расхождений: {len(found)}", file=stream)
+    return done, found
+
+def parse_fuzz_args(argv):
+    parser = argparse.ArgumentParser(description="Дифференциальное тестирование движков проверки регулярных выражений.")
+    parser.add_argument('--cases', type=int, default=100000, help="Число пар (выражение, строка).")
+    parser.add_argument('-j', '--workers', type=int, default=0, help="Число процессов (0 - по числу ядер).")
+    parser.add_argument('--seed', type=int, default=0, help="Начальное зерно генератора.")
+    parser.add_argument('--regexes-per-task', type=int, default=50, help="Выражений в одной порции работы процесса.")
+    parser.add_argument('--strings-per-regex', type=int, default=20, help="Строк на одно выражение.")
+    parser.add_argument('--max-depth', type=int, default=4, help="Глубина вложенности генерируемых выражений.")
+    parser.add_argument('--max-size', type=int, default=15, help="Наибольшее число узлов дерева выражения.")
+    parser.add_argument('--max-length', type=int, default=8, help="Наибольшая длина проверяемой строки.")
+    parser.add_argument('--alphabet', default='abc', help="Символы-операнды генерируемых выражений.")
+    parser.add_argument('--engines', default=','.join(ENGINES),
+                        help=f"Движки через запятую ({', '.join(ENGINES)}).")
+    parser.add_argument('-o', '--output', help="Файл для расхождений (строки JSON).")
+    args = parser.parse_args(argv)
+    args.engines = [name.strip() for name in args.engines.split(',') if name.strip()]
+    unknown = [name for name in args.engines if name not in ENGINES]
+    if unknown:
+        parser.error(f"Неизвестные движки: {', '.join(unknown)}.")
+    if args.workers == 0:
+        args.workers = os.cpu_count() or 1
+    return args
+
+def fuzz_main(argv):
+    args = parse_fuzz_args(argv)
+    output = open(args.output, 'a', encoding='utf-8') if args.output else None
+    try:
+        run_fuzz(args.cases, args.workers, args.seed, args.regexes_per_task, args.strings_per_regex,
+                 args.engines, args.max_depth, args.max_size, args.max_length, args.alphabet, output)
+    finally:
+        if output is not None:
+            output.close()
+
 def main():
     print("Начинаю генерацию регулярных выражений...")
 
@@ -180,4 +664,7 @@ def main():
         print()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    if len(sys.argv) > 1:
+        fuzz_main(sys.argv[1:])
+    else:
+        main()
\ No newline at end of file
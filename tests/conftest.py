@@ -0,0 +1,26 @@
+import os
+import sys
+import importlib.util
+
+import pytest
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_script(name, filename):
+    """Загружает скрипт из корня репозитория как модуль (в именах файлов пробелы)."""
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, filename))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture(scope='session')
+def rewrite():
+    """"Regular tree rewrite v3.py" под тем же именем, что и в "Test module v4.py"."""
+    return load_script('regular_tree_rewrite', 'Regular tree rewrite v3.py')
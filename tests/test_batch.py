@@ -0,0 +1,51 @@
+import io
+import json
+import multiprocessing
+
+import pytest
+
+
+# '[)]' и 'a\)' проходят is_valid_regex, но содержат лишнюю ')' - раньше to_rpn
+# падал на них с IndexError и прерывал весь прогон
+BATCH_INPUT = ['ab', '[)]', 'a\\)', 'a|b']
+BATCH_ERRORS = {2, 3}
+
+
+def run_batch_records(rewrite, workers):
+    output = io.StringIO()
+    stats = rewrite.run_batch(io.StringIO('\n'.join(BATCH_INPUT) + '\n'), output,
+                              output_format='jsonl', workers=workers, chunk_size=1)
+    return stats, [json.loads(line) for line in output.getvalue().splitlines()]
+
+
+def check_records(stats, records):
+    assert [record['line'] for record in records] == [1, 2, 3, 4]
+    assert {record['line'] for record in records if 'error' in record} == BATCH_ERRORS
+    assert records[0]['smt2'] == '(str.to_re "ab")'
+    assert stats.failed == len(BATCH_ERRORS)
+    assert stats.processed == len(BATCH_INPUT) - len(BATCH_ERRORS)
+
+
+def test_batch_records_errors_per_line(rewrite):
+    check_records(*run_batch_records(rewrite, workers=1))
+
+
+@pytest.mark.skipif('fork' not in multiprocessing.get_all_start_methods(),
+                    reason="модуль загружен через importlib, при spawn рабочие процессы его не найдут")
+def test_batch_pool_records_errors_per_line(rewrite, monkeypatch):
+    monkeypatch.setattr(rewrite, 'multiprocessing', multiprocessing.get_context('fork'))
+    check_records(*run_batch_records(rewrite, workers=2))
+
+
+def test_stage_counts_skip_parse_cache_hits(rewrite):
+    rewrite.parse_cache.clear()
+    timings = {}
+    for regex in ['ab|c', 'ab|c', 'ab|c', 'a()']:
+        try:
+            rewrite.convert_regex(regex, timings)
+        except ValueError:
+            pass
+    assert timings['items parse_cache'] == 4
+    assert timings['items validate'] == 2
+    assert timings['items parse'] == 1
+    assert timings['items SMT2Converter.convert'] == 3
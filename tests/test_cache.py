@@ -0,0 +1,43 @@
+import sqlite3
+
+
+def test_modes_share_cache_file(rewrite, tmp_path):
+    path = tmp_path / 'smt2.sqlite'
+    modes = [(False, False), (True, False), (False, True)]
+    for nary, simplify in modes:
+        cache = rewrite.SMT2DiskCache(path, rewrite.smt2_format_version(nary, simplify))
+        cache.put('ab', f'{nary} {simplify}')
+        cache.close()
+    # Чередование режимов не стирает записи друг друга
+    for nary, simplify in modes * 2:
+        cache = rewrite.SMT2DiskCache(path, rewrite.smt2_format_version(nary, simplify))
+        assert cache.get('ab') == f'{nary} {simplify}'
+        assert len(cache) == len(modes)
+        cache.close()
+
+
+def test_stale_versions_are_purged(rewrite, tmp_path):
+    path = tmp_path / 'smt2.sqlite'
+    cache = rewrite.SMT2DiskCache(path, 'old')
+    cache.put('ab', 'stale')
+    cache.close()
+    cache = rewrite.SMT2DiskCache(path)
+    cache.put('ab', 'fresh')
+    assert len(cache) == 1 and cache.get('ab') == 'fresh'
+    cache.close()
+
+
+def test_old_schema_is_replaced(rewrite, tmp_path):
+    path = tmp_path / 'smt2.sqlite'
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE meta (name TEXT PRIMARY KEY, value TEXT)")
+    connection.execute("CREATE TABLE smt2 (key BLOB PRIMARY KEY, value TEXT NOT NULL)")
+    connection.execute("INSERT INTO meta VALUES ('format_version', '1')")
+    connection.execute("INSERT INTO smt2 VALUES (x'00', 'old')")
+    connection.commit()
+    connection.close()
+    cache = rewrite.SMT2DiskCache(path)
+    assert len(cache) == 0
+    cache.put('ab', 'new')
+    assert cache.get('ab') == 'new'
+    cache.close()
@@ -0,0 +1,18 @@
+import random
+
+import pytest
+
+
+@pytest.mark.parametrize('regex', ['(a|b)*c(a|bc)*', 'ε', 'a(é|b)*', '(ab|b)*a'])
+def test_match_many_numpy_input(rewrite, regex):
+    numpy = pytest.importorskip('numpy')
+    rng = random.Random(regex)
+    strings = numpy.array([''.join(rng.choice('abcé\n\0') for _ in range(rng.randint(0, 12))) for _ in range(500)]
+                          + ['', 'a', 'ab'])
+    expected = [rewrite.compile_nfa(rewrite.parse_cache.parse(regex)).fullmatch(text) for text in strings.tolist()]
+    mask = rewrite.match_many(regex, strings, chunk_size=64)
+    assert mask.dtype == bool and mask.tolist() == expected
+    if regex.isascii():
+        encoded = numpy.array([text.encode() for text in strings.tolist()])
+        assert rewrite.match_many(regex, encoded, chunk_size=64).tolist() == expected
+    assert rewrite.match_many(regex, strings[:0]).tolist() == []
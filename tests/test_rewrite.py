@@ -0,0 +1,21 @@
+import random
+
+
+def test_trie_union_is_normal_form(rewrite):
+    rng = random.Random(0)
+    for _ in range(500):
+        words = [''.join(rng.choice('abc') for _ in range(rng.randint(0, 6))) for _ in range(rng.randint(1, 14))]
+        trie = rewrite.build_trie_union(rewrite.RewriteEngine(), words)
+        # Другой движок ничего не знает о построенных узлах и переписывает дерево заново
+        again = rewrite.RewriteEngine().simplify(trie)
+        assert rewrite.tree_to_regex(again) == rewrite.tree_to_regex(trie)
+        nfa = rewrite.compile_nfa(trie)
+        assert all(nfa.fullmatch(word) for word in words)
+
+
+def test_rule_stats_only_when_profiled(rewrite):
+    timings = {}
+    rewrite.convert_regex('foo|foobar|fob', timings, simplify=True)
+    assert 'nodes_before' not in timings and 'rule union_trie' not in timings
+    rewrite.convert_regex('foo|foobar|fob', timings, simplify=True, rule_stats=True)
+    assert timings['hits union_trie'] == 1 and timings['nodes_before'] > timings['nodes_after']
@@ -0,0 +1,49 @@
+import io
+import sys
+
+import pytest
+
+
+def test_convert_matches_recursive_reference(rewrite):
+    generator = rewrite.RegexGenerator(alphabet='abε', max_depth=8, max_size=60, seed=1)
+    for _ in range(2000):
+        tree = generator.tree()
+        expected = rewrite._recursive_smt2(tree)
+        assert rewrite.SMT2Converter(tree).convert() == expected
+        assert rewrite.SMT2Converter(rewrite.intern_tree(tree, rewrite.NodeTable())).convert() == expected
+
+
+@pytest.mark.parametrize('regex', [
+    'a' * 5000,
+    'ab*' * 2000,
+    '(a|b)*c' * 1000 + 'e|f' + 'ab' * 1000,
+    '(' * 500 + 'a' + ')*' * 500,
+    'a(' * 1000 + 'b' + ')' * 1000,
+])
+def test_convert_deep_trees(rewrite, regex):
+    tree = rewrite.parse_regex(regex)
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(100000)
+    try:
+        expected = rewrite._recursive_smt2(tree)
+    finally:
+        sys.setrecursionlimit(limit)
+    assert rewrite.SMT2Converter(tree).convert() == expected
+    stream = io.StringIO()
+    rewrite.SMT2Converter(tree).convert_to(stream)
+    assert stream.getvalue() == expected
+
+
+@pytest.mark.parametrize('regex', ['ε', 'aε', 'εab', 'a(ε|b)c', '(ε)*', '(aε)*|εε'])
+def test_epsilon_is_empty_string(rewrite, regex):
+    tree = rewrite.parse_regex(regex)
+    smt2 = rewrite.SMT2Converter(tree).convert()
+    assert 'ε' not in smt2
+    assert smt2 == rewrite._recursive_smt2(tree)
+    assert rewrite.convert_flat_to_smt2(rewrite.parse_regex_flat(regex)) == smt2
+    nary = rewrite.convert_regex(regex, nary=True)
+    assert 'ε' not in nary
+    z3 = pytest.importorskip('z3')
+    solver = z3.Solver()
+    solver.add(z3.parse_smt2_string(f'(assert (not (= {smt2} {nary})))'))
+    assert solver.check() == z3.unsat
@@ -0,0 +1,38 @@
+import random
+
+import pytest
+
+from conftest import load_script
+
+
+@pytest.fixture(scope='session')
+def demo(rewrite):
+    pytest.importorskip('z3')
+    return load_script('test_module_v4', 'Test module v4.py')
+
+
+def test_demo_corpus_is_supported(demo):
+    rng = random.Random(0)
+    for regex in demo.base_regex:
+        strings = [demo.generate_matching_string(regex)]
+        strings += [''.join(rng.choice('abcz09_ .\t') for _ in range(rng.randint(0, 4))) for _ in range(50)]
+        for text in strings:
+            assert demo.z3_check(regex, text) == demo.python_check(regex, text), (regex, text)
+
+
+@pytest.mark.parametrize('regex, text, expected', [
+    ('a{,2}', 'aa', True),
+    ('c{0}d{1,}', 'ddd', True),
+    ('(?:ab){2}', 'abab', True),
+    ('a{2,3}?b', 'b', False),
+    ('[]a-c]+', ']b', True),
+    ('a{}', 'a{}', True),
+])
+def test_extended_syntax(demo, regex, text, expected):
+    assert demo.z3_check(regex, text) is expected
+
+
+@pytest.mark.parametrize('regex', ['[^a]', '\\D', '^a', '(?=a)', 'a*+'])
+def test_unsupported_syntax(demo, regex):
+    with pytest.raises(ValueError):
+        demo.regex_to_z3_expr(regex)